@@ -0,0 +1,26 @@
+let tagSearchRequest = 0;
+
+async function fnTagSearch(prefix, selectId) {
+    // Suggestions of the tag autocomplete API, the selected tags are kept in the list
+    const select = document.getElementById(selectId);
+    const request = ++tagSearchRequest;
+    const selected = Array.from(select.options).filter((opt) => opt.selected).map((opt) => opt.value);
+
+    let names = [];
+    prefix = prefix.trim();
+    if (prefix.length > 0) {
+        const response = await fetch(`/api/tags/autocomplete?q=${encodeURIComponent(prefix)}`,
+                                     {headers: {Accept: "application/json"}});
+        if (response.ok) {
+            names = (await response.json()).map((tag) => tag.name);
+        }
+    }
+    if (request !== tagSearchRequest) {
+        return;     // a newer search has started
+    }
+
+    select.innerHTML = "";
+    for (const name of selected.concat(names.filter((name) => !selected.includes(name)))) {
+        select.add(new Option(name, name, false, selected.includes(name)));
+    }
+}
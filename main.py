@@ -1,5 +1,6 @@
 import re
-from typing import Callable
+import time
+from typing import Callable, List
 import pathlib
 import logging
 
@@ -11,18 +12,23 @@ from sqlalchemy.orm import Session
 from sqlalchemy import text
 from sqlalchemy.log import rootlogger
 
-from src.database.db import get_db
-from src.routes import auth, users, myuser, photos
-from src.conf.config import BASE_DIR
+from src.database.db import get_db, get_async_db
+from src.routes import auth, users, myuser, photos, media, tags
+from src.conf.config import BASE_DIR, settings
 from src.conf import messages
 from src.services.custom_limiter import RateLimiter
 from src.services.custom_json import Jsons
-from src.base import app, templates, user_agent_ban_list
+from src.base import app, templates, user_agent_ban_list, get_request_user
 from src.repository.tags import TagRepository
+from src.repository.photos import PhotosRepository
+from src.services import db_stats, qr_batch
+from src.services.validators import close_http_client
 
 
-logging.disable(logging.WARNING)
-# logging.disable(logging.INFO)
+logger = logging.getLogger(__name__)
+
+# logging.disable(logging.WARNING)
+logging.disable(logging.INFO)
 # rootlogger.setLevel(logging.ERROR)
 # logging.logProcesses = False
 
@@ -30,6 +36,9 @@ app.include_router(auth.router, prefix='/api/auth')
 app.include_router(users.router, prefix='/api/users')
 app.include_router(photos.router, prefix='/api/photos')
 app.include_router(myuser.router, prefix='/api/myuser')
+app.include_router(tags.router, prefix='/api/tags')
+if settings.storage_backend == 'local':
+    app.include_router(media.router, prefix=settings.storage_local_transform_url)
 
 
 BASE_DIR = pathlib.Path(__file__).parent
@@ -39,6 +48,29 @@ app.mount("/js", StaticFiles(directory=BASE_DIR / "js"), name="js")
 app.mount("/images", StaticFiles(directory=BASE_DIR / "images"), name="images")
 
 
+@app.on_event("startup")
+async def startup():
+    """
+    The startup function creates the process pool rendering QR codes of batch jobs in the worker process,
+        outside of any request. The processes of the pool are spawned on its first use.
+
+    :doc-author: Python-WEB13-project-team-2
+    """
+    qr_batch.start_process_pool()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    The shutdown function stops the process pool of the QR code batch jobs
+        and closes the connections of the shared HTTP client.
+
+    :doc-author: Python-WEB13-project-team-2
+    """
+    qr_batch.shutdown_process_pool()
+    await close_http_client()
+
+
 # @app.middleware('http')
 # async def custom_middleware(request: Request, call_next):
 #     # print(f'request.base_url: {request.base_url}')
@@ -70,6 +102,34 @@ async def user_agent_ban_middleware(request: Request, call_next: Callable):
     return response
 
 
+@app.middleware("http")
+async def db_stats_middleware(request: Request, call_next: Callable):
+    """
+    The db_stats_middleware function counts the SQL statements of a request and their cumulative time
+        (collected by the engine events of src.services.db_stats) and returns them in the
+        X-DB-Query-Count and X-DB-Query-Time (ms) headers. Requests slower than settings.slow_request_ms
+        are logged with these numbers.
+    
+    :param request: Request: Access the request object
+    :param call_next: Callable: Pass the request to the next middleware in line
+    :return: The response with the X-DB-* headers
+    :doc-author: Python-WEB13-project-team-2
+    """
+    if not settings.db_instrumentation:
+        return await call_next(request)
+
+    start = time.perf_counter()
+    stats = db_stats.start_request()
+    response = await call_next(request)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    response.headers["X-DB-Query-Count"] = str(stats.count)
+    response.headers["X-DB-Query-Time"] = str(stats.duration_ms)
+    if elapsed_ms >= settings.slow_request_ms:
+        logger.warning("Slow request %s %s: %.0f ms, %d SQL queries, %.0f ms in SQL",
+                       request.method, request.url.path, elapsed_ms, stats.count, stats.duration_ms)
+    return response
+
+
 @app.get("/", response_class=HTMLResponse, description="Main Page", dependencies=[Depends(RateLimiter(times=10, seconds=60))])
 async def root( request: Request,
                 page: int = Query(None, gt=0, description="Page number"),
@@ -77,8 +137,11 @@ async def root( request: Request,
                 user_id: int = Query(None, description="Filter by user"),
                 keyword: str = Query(None, description="Keyword to search in photo descriptions"),
                 tag: str = Query(None, description="Filter photos by tag"),
-                order_by: str = Query("newest", description="Sort order date('newest' or 'oldest'"),
-                db: Session = Depends(get_db)):
+                tags: List[str] = Query(None, description="Filter photos by several tags"),
+                tag_mode: str = Query("all", description="Tags filter mode ('all' or 'any' of tags)"),
+                order_by: str = Query("newest", description="Sort order date('newest' or 'oldest') or 'relevance' of keyword"),
+                cursor: str = Query(None, description="Cursor of the neighbouring page"),
+                db: Session = Depends(get_async_db)):
     """
     The root function is the entry point for the application.
         - It returns a TemplateResponse object, which renders an HTML template using Jinja2.
@@ -89,7 +152,15 @@ async def root( request: Request,
     :doc-author: Python-WEB13-project-team-2
     """
     # print(f"app.extra: {app.extra}")
-    images, pages = await photos.get_and_search_photos(request=request, db=db, page=page, per_page=per_page, user_id=user_id, keyword=keyword, tag=tag, order_by=order_by)
+    images, pages = await photos.get_and_search_photos(request=request, db=db, page=page, per_page=per_page, user_id=user_id, keyword=keyword, tag=tag, order_by=order_by, cursor=cursor,
+                                                       tags=tags, tag_mode=tag_mode)
+
+    view_tags = ([tag] if tag else []) + (tags or [])
+    related = []
+    if view_tags:
+        facets = await PhotosRepository().get_tag_facets(session=db, user_id=user_id, keyword=keyword,
+                                                         tags=view_tags, tag_mode=tag_mode)
+        related = [{'tag_name': facet.name, 'tag_count': facet.tag_count} for facet in facets]
 
     top_tags = await TagRepository().get_tags_max10(session=db)
     top = []
@@ -103,8 +174,11 @@ async def root( request: Request,
 
     return templates.TemplateResponse('index.html', {"request": request,
                                                      "title": messages.CONTACTS_APP, 
-                                                     "user": app.extra["user"],
+                                                     "user": get_request_user(request),
                                                      "view_tag": tag,
+                                                     "view_tags": view_tags,
+                                                     "tag_mode": tag_mode,
+                                                     "related_tags": related,
                                                      "top_tags": top,
                                                      "pages": pages,
                                                      "photos": Jsons.list_photoresponse_to_json(images)})
@@ -0,0 +1,29 @@
+"""add photos full-text search index
+
+Revision ID: 7c2e8f4b9a13
+Revises: 3f9c1d2a7b64
+Create Date: 2026-10-18 11:03:27.540192
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2e8f4b9a13'
+down_revision: Union[str, None] = '3f9c1d2a7b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The expression must match FTS_DOCUMENT in src/repository/photos.py
+    op.create_index('ix_photos_description_fts', 'photos',
+                    [sa.text("to_tsvector('simple'::regconfig, coalesce(description, ''))")],
+                    unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_photos_description_fts', table_name='photos')
@@ -0,0 +1,35 @@
+"""add qr codes
+
+Revision ID: b4d7e1c9f0a2
+Revises: 7c2e8f4b9a13
+Create Date: 2026-10-18 14:12:40.318526
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4d7e1c9f0a2'
+down_revision: Union[str, None] = '7c2e8f4b9a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('qr_codes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('url', sa.String(length=255), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('hash'),
+    sa.UniqueConstraint('url')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('qr_codes')
@@ -0,0 +1,30 @@
+"""add tags photo_count
+
+Revision ID: d2a8f3b61e47
+Revises: b4d7e1c9f0a2
+Create Date: 2026-10-18 16:05:12.904311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2a8f3b61e47'
+down_revision: Union[str, None] = 'b4d7e1c9f0a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tags', sa.Column('photo_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute("UPDATE tags SET photo_count = "
+               "(SELECT count(*) FROM tag_m2m_photo WHERE tag_m2m_photo.tag_id = tags.id)")
+    op.create_index('ix_tags_photo_count', 'tags', ['photo_count'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tags_photo_count', table_name='tags')
+    op.drop_column('tags', 'photo_count')
@@ -0,0 +1,28 @@
+"""add photos comment_count
+
+Revision ID: e6b1c4a90d35
+Revises: d2a8f3b61e47
+Create Date: 2026-10-18 17:21:48.117205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6b1c4a90d35'
+down_revision: Union[str, None] = 'd2a8f3b61e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('photos', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute("UPDATE photos SET comment_count = "
+               "(SELECT count(*) FROM comments WHERE comments.photo_id = photos.id)")
+
+
+def downgrade() -> None:
+    op.drop_column('photos', 'comment_count')
@@ -1,17 +1,14 @@
 from typing import Dict
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 
 
 app = FastAPI()
-app.extra.update({"user": {"is_authenticated": False}})
 app.extra.update({"errors": []})
 app.extra.update({"history": []})
-app.extra.update({"qualifiers": {}})
-app.extra.update({"qualifiers_ts": 0})
 
 
 app.add_middleware(
@@ -26,6 +23,22 @@ app.add_middleware(
 templates = Jinja2Templates(directory='templates')
 
 
+def get_request_user(request: Request) -> Dict:
+    """
+    The logged-in user of the request for the templates, set by Auth.check_authentication.
+    It is kept in request.state, so concurrent requests and workers do not share it.
+    """
+    user = getattr(request.state, "user", None)
+    if user is None:
+        user = {"is_authenticated": False}
+        request.state.user = user
+    return user
+
+
+def set_request_user(request: Request, user: Dict) -> None:
+    request.state.user = user
+
+
 user_agent_ban_list = [r"Python-urllib"]
 # user_agent_ban_list = [r"Gecko", r"Python-urllib"]
 
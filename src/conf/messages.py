@@ -30,6 +30,11 @@ NO_MORE_THAN_10_REQUESTS_PER_MINUTE = "No more than 10 requests per minute"
 NOT_FOUND = "Not Found"
 FORBIDDEN = "Operation forbidden"
 BAD_REQUEST = "Bad request"
+INVALID_CURSOR = "Invalid pagination cursor"
+STORAGE_TIMEOUT = "File storage did not respond in time"
+JOB_NOT_FOUND = "Job not found"
+INVALID_TRANSFORMATION = "Invalid transformation"
+STORAGE_FOLDER_NOT_FOUND = "Storage folder of the image not found"
 
 CONTACTS_APP = "PhotoShare"
 WELCOME_TO_FASTAPI = "Welcome to FastAPI!"
@@ -1,7 +1,12 @@
+from typing import Any, Callable
+
 from fastapi import HTTPException, status
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
 from src.conf.config import settings
 
@@ -13,9 +18,67 @@ port = settings.postgres_port
 database = settings.postgres_db
 URL = settings.sqlalchemy_database_url
 
-engine = create_engine(URL, echo=True)
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def get_async_url(url: str) -> str:
+    """
+    The get_async_url function builds the URL of the async engine from the URL of the sync engine
+        by replacing its driver (postgresql+psycopg2 -> postgresql+asyncpg, sqlite -> sqlite+aiosqlite).
+
+    :param url: str: The URL of the sync engine
+    :return: The URL of the async engine
+    :doc-author: Python-WEB13-project-team-2
+    """
+    url_ = make_url(url)
+    backend = url_.get_backend_name()
+    if backend in ASYNC_DRIVERS:
+        url_ = url_.set(drivername=ASYNC_DRIVERS[backend])
+    return url_.render_as_string(hide_password=False)
+
+
+def get_engine_options(url: str) -> dict:
+    """
+    The get_engine_options function builds the keyword arguments of create_engine/create_async_engine
+        from the settings: echo, the connection pool (size, overflow, recycle, pre-ping) and
+        the statement timeout, which is passed to PostgreSQL in the way of the driver of the URL.
+        SQLite uses its own pools, so only echo is applied to it.
+
+    :param url: str: The URL of the engine
+    :return: A dictionary of the engine options
+    :doc-author: Python-WEB13-project-team-2
+    """
+    options = {"echo": settings.db_echo}
+    url_ = make_url(url)
+    if url_.get_backend_name() == "sqlite":
+        return options
+
+    options.update({"pool_size": settings.db_pool_size,
+                    "max_overflow": settings.db_max_overflow,
+                    "pool_recycle": settings.db_pool_recycle,
+                    "pool_pre_ping": settings.db_pool_pre_ping})
+    if settings.db_statement_timeout and url_.get_backend_name() == "postgresql":
+        if url_.get_driver_name() == "asyncpg":
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(settings.db_statement_timeout)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={settings.db_statement_timeout}"}
+    return options
+
+
+ASYNC_URL = settings.sqlalchemy_async_database_url or get_async_url(URL)
+
+engine = create_engine(URL, **get_engine_options(URL))
 DBSession = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+async_engine = create_async_engine(ASYNC_URL, **get_engine_options(ASYNC_URL))
+
+# The repositories insert with ON CONFLICT, which is available only in these dialects
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+for engine_ in (engine, async_engine):
+    if engine_.dialect.name not in UPSERT_INSERTS:
+        raise RuntimeError(f"Database {engine_.dialect.name} is not supported, INSERT ... ON CONFLICT is required")
+AsyncDBSession = async_sessionmaker(bind=async_engine, autoflush=False, autocommit=False, expire_on_commit=False)
+
 
 # Dependency
 def get_db():
@@ -34,3 +97,94 @@ def get_db():
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
     finally:
         db.close()
+
+
+# Dependency
+async def get_async_db():
+    """
+    The get_async_db function is the async version of get_db: it yields an AsyncSession,
+        so database I/O of a request does not block the event loop and other requests.
+        Objects are not expired on commit, because lazy loading of expired attributes is not possible in async code.
+
+    :return: An async context manager that can be used to get a database connection
+    :doc-author: Python-WEB13-project-team-2
+    """
+    db = AsyncDBSession()
+    try:
+        yield db
+    except SQLAlchemyError as err:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    finally:
+        await db.close()
+
+
+# Helpers for the repositories, which work with both Session and AsyncSession
+async def db_execute(session: Session | AsyncSession, statement: Any, params: Any = None):
+    if isinstance(session, AsyncSession):
+        return await session.execute(statement, params)
+    return session.execute(statement, params)
+
+
+async def db_commit(session: Session | AsyncSession) -> None:
+    if isinstance(session, AsyncSession):
+        await session.commit()
+    else:
+        session.commit()
+
+
+async def db_rollback(session: Session | AsyncSession) -> None:
+    if isinstance(session, AsyncSession):
+        await session.rollback()
+    else:
+        session.rollback()
+
+
+async def db_refresh(session: Session | AsyncSession, instance: Any) -> None:
+    if isinstance(session, AsyncSession):
+        await session.refresh(instance)
+    else:
+        session.refresh(instance)
+
+
+async def db_delete(session: Session | AsyncSession, instance: Any) -> None:
+    if isinstance(session, AsyncSession):
+        await session.delete(instance)
+    else:
+        session.delete(instance)
+
+
+async def db_merge(session: Session | AsyncSession, instance: Any, load: bool = True) -> Any:
+    if isinstance(session, AsyncSession):
+        return await session.merge(instance, load=load)
+    return session.merge(instance, load=load)
+
+
+def db_insert(session: Session | AsyncSession, table: Any):
+    """
+    The INSERT of the dialect of the session, it supports ON CONFLICT (on_conflict_do_nothing/do_update).
+    """
+    return UPSERT_INSERTS[session.get_bind().dialect.name](table)
+
+
+def db_after_commit(session: Session | AsyncSession, callback: Callable[[], None]) -> None:
+    """
+    Run the callback after the current transaction of the session is committed, e.g. to update
+    in-memory caches only with committed data. The callback is dropped if the transaction is rolled back.
+    """
+    if isinstance(session, AsyncSession):
+        session = session.sync_session
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session: Session) -> None:
+    for callback in session.info.pop("after_commit", []):
+        callback()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_after_commit(session: Session, transaction) -> None:
+    # a rolled back or closed transaction, the callbacks of a committed one have already run
+    if transaction.parent is None:
+        session.info.pop("after_commit", None)
@@ -1,6 +1,6 @@
 import enum
 
-from sqlalchemy import Column, Integer, String, DateTime, func, event, UniqueConstraint, Boolean, Enum
+from sqlalchemy import Column, Integer, String, DateTime, func, event, UniqueConstraint, Boolean, Enum, Index, literal_column
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql.schema import ForeignKey, Table
 
@@ -43,15 +43,29 @@ class Photo(Base, PrimaryKeyABC, DateTimeABC):
     file_url = Column(String, nullable=False, unique=True)
     qr_url = Column(String(255), nullable=True, unique=True)
     description = Column(String, nullable=True)
+    comment_count = Column(Integer, nullable=False, default=0, server_default="0")   # maintained with the comments
     # created_at = Column('created_at', DateTime, default=func.now())
     # updated_at = Column('updated_at', DateTime, default=func.now(), onupdate=func.now())
     user = relationship('User', backref='photos')
 
+    __table_args__ = (
+        Index('ix_photos_created_at_id', 'created_at', 'id'),     # keyset pagination of the feed
+        # full-text search of the keyword, the expression must match FTS_DOCUMENT in src/repository/photos.py
+        Index('ix_photos_description_fts',
+              func.to_tsvector(literal_column("'simple'::regconfig"), func.coalesce(description, literal_column("''"))),
+              postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
+
 
 class Tag(Base, PrimaryKeyABC, CreatedABC):
     __tablename__ = "tags"
     # id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False, unique=True)
+    photo_count = Column(Integer, nullable=False, default=0, server_default="0")   # maintained by TagRepository
+
+    __table_args__ = (
+        Index('ix_tags_photo_count', 'photo_count'),     # top tags of the home page
+    )
 
 
 tag_photo_association = Table(
@@ -84,6 +98,14 @@ class PhotoURL(Base, PrimaryKeyABC, DateTimeABC):
     photo = relationship('Photo', backref='photo_urls')
 
 
+class QRCode(Base, PrimaryKeyABC, CreatedABC):
+    __tablename__ = "qr_codes"
+    # id = Column(Integer, primary_key=True)
+    hash = Column(String(64), nullable=False, unique=True)     # sha256 of (file_url, fill_color, back_color)
+    url = Column(String(255), nullable=False, unique=True)
+    ref_count = Column(Integer, nullable=False, default=0)     # photos and transforms using the QR code
+
+
 class Comment(Base, PrimaryKeyABC, DateTimeABC):
     __tablename__ = "comments"
     # id = Column(Integer, primary_key=True)
@@ -94,3 +116,7 @@ class Comment(Base, PrimaryKeyABC, DateTimeABC):
     # updated_at = Column('updated_at', DateTime, default=func.now(), onupdate=func.now())
     photo = relationship('Photo', backref='comments')
     user = relationship('User', backref='comments')
+
+    __table_args__ = (
+        Index('ix_comments_photo_id_id', 'photo_id', 'id'),     # keyset pagination of the comments of a photo
+    )
@@ -4,7 +4,7 @@ from fastapi import HTTPException, Depends, Request
 from fastapi.security.utils import get_authorization_scheme_param
 from sqlalchemy.orm import Session
 
-from src.base import app
+from src.base import set_request_user
 from src.database.models import User
 from src.repository import users as repository_users
 from src.services.auth import auth_service
@@ -23,12 +23,12 @@ class Auth:
         # print(f">>> check_authentication: scheme={scheme}, param={param}")
         current_user = None
         try:
-            current_user = await auth_service.get_current_user(token=param, db=db)
+            current_user = await auth_service.get_current_user(request=request, token=param, db=db)
             # print(f">>> check_authentication: current_user.id={current_user}")
             if not is_logout:
                 log_user = Jsons.userresponse_to_json(user=current_user, auth=True)
                 # print(f">>> check_authentication: current_user={log_user}")
-                app.extra.update({"user": log_user})
+                set_request_user(request, log_user)
                 return current_user
         
         except HTTPException as err:
@@ -36,8 +36,7 @@ class Auth:
                 # print(f">>> check_authentication: HTTPException = {err.detail}")
                 self.errors.append({"key": "message", "value": err.detail})
 
-            user = app.extra["user"]
-            email = user.get("email")
+            email = auth_service.get_email_from_expired_token(param)
             if email:
                 try:
                     current_user = await repository_users.get_user_by_email(email, db)
@@ -51,9 +50,7 @@ class Auth:
             db.commit
             # print(f">>> check_authentication: refresh_token = None")
         
-        app.extra.pop("user")
-        app.extra.update({"user": {"is_authenticated": False}})
-        # app.extra["user"].update({"is_authenticated": False})
+        set_request_user(request, {"is_authenticated": False})
         # print(f">>> check_authentication: is_authenticated = False")
 
         return None
@@ -1,12 +1,14 @@
-from typing import List
+from typing import List, Dict, Tuple
 
-from sqlalchemy import and_, desc
+from sqlalchemy import and_, desc, select, update, func
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 
 from src.conf import messages
+from src.database.db import db_execute, db_commit, db_refresh, db_delete
 from src.schemas import CommentModel, CommentUpdate, CommentDelete
 from src.database.models import Comment, User, Photo, UserRole
+from src.services.pager import Cursor
 
 
 async def get_comments(page: int, per_page: int, photo_id: int, db: Session) -> List[Comment]:
@@ -22,31 +24,121 @@ async def get_comments(page: int, per_page: int, photo_id: int, db: Session) ->
     """
     if page and per_page:
         offset = (page - 1) * per_page
-        comments = db.query(Comment.id,
-                            Comment.text,
-                            Comment.user_id,
-                            User.username
-                            ) \
-                    .select_from(Comment) \
-                    .join(User) \
-                    .filter(Comment.photo_id == photo_id) \
-                    .order_by(desc(Comment.id)) \
-                    .offset(offset).limit(per_page).all()
+        sel = select(Comment.id,
+                     Comment.text,
+                     Comment.user_id,
+                     User.username
+                     ) \
+                .select_from(Comment) \
+                .outerjoin(User) \
+                .filter(Comment.photo_id == photo_id) \
+                .order_by(desc(Comment.id)) \
+                .offset(offset).limit(per_page)
     else:
-        comments = db.query(Comment.id,
-                            Comment.text,
-                            Comment.user_id,
-                            User.username
-                            ) \
-                    .select_from(Comment) \
-                    .join(User) \
-                    .filter(Comment.photo_id == photo_id) \
-                    .order_by(desc(Comment.id)) \
-                    .all()
+        sel = select(Comment.id,
+                     Comment.text,
+                     Comment.user_id,
+                     User.username
+                     ) \
+                .select_from(Comment) \
+                .outerjoin(User) \
+                .filter(Comment.photo_id == photo_id) \
+                .order_by(desc(Comment.id))
+    comments = (await db_execute(db, sel)).all()
 
     return comments  # noqa
 
 
+async def get_comments_thread(photo_id: int, limit: int, cursor: str | None, db: Session) -> Tuple[List[Comment], str | None, int]:
+    """
+    Returns a page of the comments of a photo, newest first, paginated by keyset on (photo_id, id):
+    the next page starts after the id of the cursor, so deep pages cost the same as the first one.
+
+    Args:
+        photo_id (int): The id of the desired photo.
+        limit (int): The number of comments of the page.
+        cursor (str | None): The next_cursor of the previous page, None for the first page.
+        db (Session): The database session.
+
+    Returns:
+        Tuple[List[Comment], str | None, int]: The comments, the cursor of the next page (None on
+        the last page) and the number of comments of the photo.
+    """
+    total = (await db_execute(db, select(Photo.comment_count).where(Photo.id == photo_id))).scalar_one_or_none()
+    if total is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=messages.PHOTO_NOT_FOUND)
+
+    sel = select(Comment.id,
+                 Comment.text,
+                 Comment.user_id,
+                 User.username
+                 ) \
+            .select_from(Comment) \
+            .outerjoin(User) \
+            .filter(Comment.photo_id == photo_id) \
+            .order_by(desc(Comment.id)) \
+            .limit(limit + 1)
+    if cursor:
+        (last_id,), _ = Cursor.decode(cursor, [Comment.id])
+        if not isinstance(last_id, int) or isinstance(last_id, bool):
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=messages.INVALID_CURSOR)
+        sel = sel.filter(Comment.id < last_id)
+    comments = (await db_execute(db, sel)).all()
+
+    next_cursor = get_comments_cursor(comments[limit - 1]) if len(comments) > limit else None
+    return comments[:limit], next_cursor, total
+
+
+def get_comments_cursor(comment: Comment) -> str:
+    """
+    The cursor of the comments after the given one (see get_comments_thread).
+    """
+    return Cursor.encode([comment.id], Cursor.NEXT)
+
+
+async def get_comments_photos(photo_ids: List[int], limit: int, db: Session) -> Dict[int, List[Comment]]:
+    """
+    Returns the latest comments for several photos in a single query.
+
+    Args:
+        photo_ids (List[int]): The ids of the desired photos.
+        limit (int): The number of latest comments per photo (0 - all comments).
+        db (Session): The database session.
+
+    Returns:
+        Dict[int, List[Comment]]: Lists of comments (newest first) keyed by photo_id
+    """
+    result = {photo_id: [] for photo_id in photo_ids}
+    if not photo_ids:
+        return result
+
+    row_number = func.row_number().over(partition_by=Comment.photo_id,
+                                        order_by=desc(Comment.id)).label('row_number')
+    sub = select(Comment.id,
+                 Comment.text,
+                 Comment.user_id,
+                 Comment.photo_id,
+                 User.username,
+                 row_number) \
+            .select_from(Comment) \
+            .outerjoin(User) \
+            .where(Comment.photo_id.in_(photo_ids)) \
+            .subquery()
+
+    query = select(sub.c.id,
+                   sub.c.text,
+                   sub.c.user_id,
+                   sub.c.photo_id,
+                   sub.c.username) \
+            .order_by(sub.c.photo_id, desc(sub.c.id))
+    if limit:
+        query = query.where(sub.c.row_number <= limit)
+
+    for comment in (await db_execute(db, query)).all():
+        result[comment.photo_id].append(comment)
+    return result
+
+
 async def get_comment_by_id(photo_id: int, comment_id: int, db: Session) -> Comment:
     """
     Returns all comments associated with that photo.
@@ -58,16 +150,16 @@ async def get_comment_by_id(photo_id: int, comment_id: int, db: Session) -> Comm
     Returns:
         List[Comment]: A list of comments for a given photo_id
     """
-    comment = db.query(Comment.id,
-                       Comment.text,
-                       Comment.user_id,
-                       User.username
-                       ) \
-                .select_from(Comment) \
-                .join(User) \
-                .filter(Comment.photo_id == photo_id) \
-                .order_by(desc(Comment.id)) \
-                .first()
+    sel = select(Comment.id,
+                 Comment.text,
+                 Comment.user_id,
+                 User.username
+                 ) \
+            .select_from(Comment) \
+            .outerjoin(User) \
+            .filter(Comment.photo_id == photo_id) \
+            .order_by(desc(Comment.id))
+    comment = (await db_execute(db, sel)).first()
 
     return comment  # noqa
 
@@ -85,19 +177,22 @@ async def create_comment(photo_id: int, body: CommentModel, user: User, db: Sess
     Returns:
         Comment: The newly created comment.
     """
-    photo = db.query(Photo).filter(Photo.id == photo_id).first()
-    if not photo:
+    # counting the comment also checks that the photo exists, the counter does not change updated_at of the photo
+    query = update(Photo).where(Photo.id == photo_id) \
+        .values(comment_count=Photo.comment_count + 1, updated_at=Photo.updated_at) \
+        .returning(Photo.id)
+    if (await db_execute(db, query)).scalar_one_or_none() is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail=messages.PHOTO_NOT_FOUND)
     
     comment = Comment(
         text=body.text,
-        user=user,
-        photo=photo
+        user_id=user.id,
+        photo_id=photo_id
     )
 
     db.add(comment)
-    db.commit()
-    db.refresh(comment)
+    await db_commit(db)
+    await db_refresh(db, comment)
     return await get_comment_by_id(photo_id=photo_id, comment_id=comment.id, db=db)
 
     # return comment
@@ -115,12 +210,13 @@ async def update_comment(photo_id: int, comment_id: int, body: CommentModel, use
     Returns:
         Comment | None: The updated comment, or None if the comment does not exist.
     """
-    comment = db.query(Comment).filter(and_(Comment.photo_id == photo_id, Comment.id == comment_id)).first()
+    sel = select(Comment).where(and_(Comment.photo_id == photo_id, Comment.id == comment_id))
+    comment = (await db_execute(db, sel)).scalars().first()
 
     if comment:
         if user.id == comment.user_id:
             comment.text = body.text
-            db.commit()
+            await db_commit(db)
         else:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=messages.OPERATION_NOT_AVAILABLE)
     else:
@@ -141,12 +237,16 @@ async def delete_comment(photo_id: int, comment_id: int, user: User, db: Session
     Returns:
         Comment | None: The deleted comment, or None if the comment does not exist.
     """
-    comment = db.query(Comment).filter(and_(Comment.photo_id == photo_id, Comment.id == comment_id)).first()
+    sel = select(Comment).where(and_(Comment.photo_id == photo_id, Comment.id == comment_id))
+    comment = (await db_execute(db, sel)).scalars().first()
 
     if comment:
         if user.id == comment.user_id or user.roles in [UserRole.admin, UserRole.moderator]:
-            db.delete(comment)
-            db.commit()
+            await db_delete(db, comment)
+            query = update(Photo).where(Photo.id == photo_id).values(comment_count=Photo.comment_count - 1,
+                                                                  updated_at=Photo.updated_at)
+            await db_execute(db, query)
+            await db_commit(db)
         else:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=messages.OPERATION_NOT_AVAILABLE)
     else:
@@ -1,11 +1,9 @@
-import re
-import qrcode
-import aiofiles.os
 import json
+import re
 from typing import List, Optional
 
 from fastapi import HTTPException, status, UploadFile
-from sqlalchemy import insert, select, update, delete, desc, asc, and_
+from sqlalchemy import insert, select, update, delete, desc, asc, and_, func, literal_column, false
 from sqlalchemy.orm import Session
 
 from src.base import app, templates
@@ -14,16 +12,47 @@ from src.repository.tags import TagRepository
 from src.schemas import PhotoTransformModel, PhotoQRCodeModel, PhotoResponse
 from src.conf import messages
 from src.conf.config import MAX_TAGS_COUNT
-from src.services.cloud_image import CloudImage
+from src.services.storage import storage
+from src.repository.qr_codes import acquire_qrcode, release_qrcode
+from src.services.qr_code import render_qrcode_async
 from src.services.validators import Validator
 from src.services.custom_json import Jsons
-from src.repository.comments import get_comments
+from src.repository.comments import get_comments_photos
 from src.services.pager import Pagination
+from src.database.db import db_execute, db_commit, db_rollback, db_refresh, db_delete
+
 
 
+# Must match the expression of the ix_photos_description_fts GIN index (see migrations), otherwise it is not used
+FTS_CONFIG = literal_column("'simple'::regconfig")
+FTS_DOCUMENT = func.to_tsvector(FTS_CONFIG, func.coalesce(Photo.description, literal_column("''")))
+
 
 class PhotosRepository:
 
+    @staticmethod
+    def keyword_filter(keyword: str, session: Session):
+        """
+        Build the filter and the rank expression of a keyword search in photo descriptions.
+        On Postgres every word of the keyword is a prefix (word:*) of a full-text query served by
+        the GIN index, on other databases (SQLite tests) every word is matched with ILIKE.
+        Args:
+            keyword (str): One or several words to search for.
+            session (Session): The database session.
+        Returns:
+            The filter expression (false - no words in keyword, nothing matches) and the rank expression (None - no ranking).
+        """
+        words = re.findall(r"\w+", keyword)
+        if not words:
+            return false(), None
+
+        if session.get_bind().dialect.name == "postgresql":
+            ts_query = func.to_tsquery(FTS_CONFIG, " & ".join(f"{word}:*" for word in words))
+            return FTS_DOCUMENT.op("@@")(ts_query), func.ts_rank(FTS_DOCUMENT, ts_query)
+
+        return and_(*[Photo.description.ilike(f"%{word}%") for word in words]), None
+
+
     async def upload_new_photo(self,
                                photo_description: str,
                                tags: List[str],
@@ -46,19 +75,20 @@ class PhotosRepository:
         """
         user_id = current_user.id
         try:
-            photo_url = CloudImage.upload_image(photo_file=photo_file.file, user=current_user)
+            photo_url = await storage.upload_image(photo_file=photo_file.file, user=current_user,
+                                                 filename=photo_file.filename)
 
             query = insert(Photo).values(
                 description=photo_description,
                 file_url=photo_url,
                 user_id=user_id,
             ).returning(Photo)
-            new_photo = session.execute(query).scalar_one()
+            new_photo = (await db_execute(session, query)).scalar_one()
 
             tags_list = []
             if tags:
                 tags_list = await TagRepository().add_tags_to_photo(tags, new_photo.id, session, False)
-            session.commit()
+            await db_commit(session)
             # session.refresh(new_photo)
             # return {"photo": new_photo, "tags": tags_list, "comments": []}
             return new_photo
@@ -87,7 +117,7 @@ class PhotosRepository:
         tags_new, tags_full = await TagRepository().get_different_tags(tags, tags_photo)
         await Validator().validate_tags_count(tags_str="", tags=tags_full)
         await TagRepository().add_tags_to_photo(tags_new, photo_id, session, False)
-        session.commit()
+        await db_commit(session)
         photo = await self.get_photo_by_id(photo_id=photo_id, session=session)
         return photo
 
@@ -109,12 +139,13 @@ class PhotosRepository:
             updated_photo = await remove_tag_from_photo("landscape", 1, current_user, session)
         """
         query = select(Tag).where(Tag.name == tag)
-        tag_ = session.execute(query).scalar_one_or_none()
+        tag_ = (await db_execute(session, query)).scalar_one_or_none()
         if not tag_:
             raise HTTPException(status.HTTP_404_NOT_FOUND, detail=messages.TAG_PHOTO_NOT_FOUND)
-        query = delete(t2p).where(t2p.c.tag_id == tag_.id, t2p.c.photo_id == photo_id)
-        session.execute(query)
-        session.commit()
+        query = delete(t2p).where(t2p.c.tag_id == tag_.id, t2p.c.photo_id == photo_id).returning(t2p.c.tag_id)
+        removed = (await db_execute(session, query)).scalars().all()
+        await TagRepository().update_photo_count(removed, -1, session)
+        await db_commit(session)
         photo = await self.get_photo_by_id(photo_id=photo_id, session=session)
         return photo
 
@@ -130,34 +161,77 @@ class PhotosRepository:
         Raises:
             HTTPException: If the photo is not found or an error occurs during deletion.
         """
-        query = delete(Photo).where(Photo.id == photo_id).returning(Photo)
-        photo = session.execute(query).scalar_one_or_none()
         tags = await TagRepository().get_tags_photo(photo_id, session)
-        comm = await get_comments(page=0, per_page=0, photo_id=photo.id, db=session)
+        await TagRepository().unlink_photo_tags(photo_id, session)
+        query = delete(Photo).where(Photo.id == photo_id).returning(Photo)
+        photo = (await db_execute(session, query)).scalar_one_or_none()
+        comm = (await get_comments_photos([photo_id], MAX_TAGS_COUNT, session))[photo_id]
 
         if not photo:
             raise HTTPException(status.HTTP_404_NOT_FOUND, detail=messages.PHOTO_NOT_FOUND)
         elif photo.user_id != current_user.id and current_user.roles != UserRole.admin:
-            session.rollback()
+            await db_rollback(session)
             raise HTTPException(status.HTTP_403_FORBIDDEN, detail=messages.OPERATION_NOT_AVAILABLE)
 
         await self.delete_all_transform_photo(photo, session, is_commit=False)
 
         if photo.qr_url:
-            result = CloudImage.delete_image(photo.qr_url)
+            result = await release_qrcode(photo.qr_url, session)
             if result:
-                session.rollback()
+                await db_rollback(session)
                 raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
 
-        result = CloudImage.delete_image(photo.file_url)
+        result = await storage.delete_image(photo.file_url)
         if result:
-            session.rollback()
+            await db_rollback(session)
             raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
         
-        session.commit()
+        await db_commit(session)
         return {"photo": photo, "tags": tags, "comments": comm}
 
 
+    def photos_filter(self,
+                      session: Session,
+                      user_id: int=None,
+                      keyword: str=None,
+                      tags: List[str]=None,
+                      tag_mode: str='all'):
+        """
+        Build the conditions of a photo search, shared by the search itself and its tag facets.
+
+        Args:
+            session (Session): The database session.
+            user_id (int): Filter by the owner of photos.
+            keyword (str): The keyword to search for in photo descriptions.
+            tags (List[str]): The tags to filter photos by.
+            tag_mode (str): 'all' - photos having every tag (AND), 'any' - having one of tags (OR).
+
+        Returns:
+            The list of conditions on Photo and the rank expression of the keyword (None - no ranking).
+        """
+        conditions = []
+        if user_id:
+            conditions.append(Photo.user_id == user_id)
+
+        rank = None
+        if keyword:
+            keyword_filter, rank = self.keyword_filter(keyword, session)
+            conditions.append(keyword_filter)
+
+        tags = list(dict.fromkeys(tag for tag in tags or [] if tag))
+        if tags:
+            # Tag names are resolved inside the same query, an unknown tag gives an empty result
+            tagged = select(t2p.c.photo_id) \
+                        .join(Tag, Tag.id == t2p.c.tag_id) \
+                        .where(Tag.name.in_(tags))
+            if tag_mode != 'any' and len(tags) > 1:
+                tagged = tagged.group_by(t2p.c.photo_id) \
+                               .having(func.count(func.distinct(t2p.c.tag_id)) == len(tags))
+            conditions.append(Photo.id.in_(tagged))
+
+        return conditions, rank
+
+
     async def search_photos(self,
                             session: Session, 
                             page: int=None, 
@@ -165,59 +239,125 @@ class PhotosRepository:
                             user_id: int=None, 
                             keyword: str=None, 
                             tag: str=None, 
-                            order_by: str=None):
+                            order_by: str=None,
+                            cursor: str=None,
+                            tags: List[str]=None,
+                            tag_mode: str='all'):
         """
-        Search for photos by keyword or tag and filter the results by rating or date.
+        Search for photos by keyword or tags and filter the results by rating or date.
 
         Args:
             keyword (str): The keyword to search for in photo descriptions.
             tag (str): The tag to filter photos by.
-            order_by (str): The sorting criteria ('rating' or 'date').
+            tags (List[str]): More tags to filter photos by (together with tag).
+            tag_mode (str): 'all' - photos having every tag (AND), 'any' - having one of tags (OR).
+            order_by (str): The sorting criteria ('newest', 'oldest' or 'relevance' of the keyword).
+            cursor (str): The keyset cursor of the neighbouring page (next_cursor/prev_cursor).
             session (Session): The database session.
 
         Returns:
             List[Photo]: A list of Photo objects that match the search and filter criteria.
         """
         # offset = (page - 1) * per_page
-        
+        tags = ([tag] if tag else []) + (tags or [])
+        conditions, rank = self.photos_filter(session, user_id, keyword, tags, tag_mode)
+
         photos_query = select(Photo.id,
                               Photo.user_id,
                               Photo.file_url,
                               Photo.description,
                               Photo.created_at,
                               Photo.updated_at,
-                              Photo.qr_url)
-
-        if user_id:
-            photos_query = photos_query.where(Photo.user_id == user_id)
-            
-        if keyword:
-            keyword_filter = Photo.description.ilike(f"%{keyword}%")
-            photos_query = photos_query.where(keyword_filter)
-
-        if tag:
-            tag_query = select(Tag).where(Tag.name == tag)
-            tag_obj = session.execute(tag_query).scalar_one_or_none()
-
-            if tag_obj:
-                tag_filter = t2p.c.tag_id == tag_obj.id
-                photos_query = photos_query.join(t2p).where(tag_filter)
+                              Photo.qr_url) \
+                        .where(*conditions)
 
         if order_by == 'newest':
             photos_query = photos_query.order_by(Photo.created_at.desc())
         elif order_by == 'oldest':
             photos_query = photos_query.order_by(Photo.created_at.asc())
-        
+        elif order_by == 'relevance' and rank is not None:
+            photos_query = photos_query.order_by(rank.desc(), Photo.created_at.desc(), Photo.id.desc())
+
         # photos = session.execute(photos_query.offset(offset).limit(per_page)).scalars().all()
-        paginate = Pagination(photos_query, session, page, per_page)
-        photos, pages = paginate.get_page()
-        result = []
-        for photo in photos:
-            ph1 = await self.get_photo_by_id(photo_id=photo.id, session=session, limit_comment=MAX_TAGS_COUNT)
-            result.append(ph1)
+        if order_by == 'relevance' and rank is not None:
+            # Rank is computed per query, so the relevance order is paged by offset
+            paginate = Pagination(photos_query, session, page, per_page)
+        else:
+            paginate = Pagination(photos_query, session, page, per_page,
+                                  keys=[Photo.created_at, Photo.id], descending=order_by != 'oldest', cursor=cursor,
+                                  estimate=not conditions)
+        photos, pages = await paginate.get_page()
+        result = await self.get_photos_by_ids(photo_ids=[photo.id for photo in photos],
+                                              session=session,
+                                              limit_comment=MAX_TAGS_COUNT)
         return result, pages
 
 
+    async def get_tag_facets(self,
+                             session: Session,
+                             user_id: int=None,
+                             keyword: str=None,
+                             tags: List[str]=None,
+                             tag_mode: str='all',
+                             limit: int=10):
+        """
+        Count the tags co-occurring on the photos of a search, in a single query.
+
+        Args:
+            session (Session): The database session.
+            user_id, keyword, tags, tag_mode: The search criteria (see search_photos).
+            limit (int): The number of the most frequent tags.
+
+        Returns:
+            List[Row]: Rows (id, name, tag_count) ordered by tag_count, the searched tags are excluded.
+        """
+        conditions, rank = self.photos_filter(session, user_id, keyword, tags, tag_mode)
+        found = select(Photo.id).where(*conditions)
+
+        query = select(Tag.id, Tag.name, func.count(t2p.c.photo_id).label('tag_count')) \
+                    .join(t2p, Tag.id == t2p.c.tag_id) \
+                    .where(t2p.c.photo_id.in_(found)) \
+                    .group_by(Tag.id, Tag.name) \
+                    .order_by(desc('tag_count'), Tag.name) \
+                    .limit(limit)
+        if tags:
+            query = query.where(Tag.name.not_in(tags))
+        return (await db_execute(session, query)).all()
+
+
+    async def get_photos_by_ids(self, photo_ids: List[int], session: Session, limit_comment: int = 0) -> List[dict]:
+        """
+        Retrieve several photos with owners, tags and latest comments in a fixed number of queries
+        Args:
+            photo_ids (List[int]): The IDs of the photos to be retrieved (the order is preserved).
+            session: The database session
+            limit_comment (int): The number of latest comments per photo (0 - all comments).
+        Returns:
+            List[dict]: The list of {"photo", "tags", "comments"} dictionaries, missing photos are skipped
+        """
+        if not photo_ids:
+            return []
+
+        query = select(Photo.id,
+                       Photo.file_url,
+                       Photo.qr_url,
+                       Photo.description,
+                       Photo.created_at,
+                       Photo.user_id,
+                       Photo.comment_count,
+                       User.username
+                      ) \
+                    .select_from(Photo) \
+                    .join(User) \
+                    .where(Photo.id.in_(photo_ids))
+        photos = {photo.id: photo for photo in (await db_execute(session, query)).all()}
+
+        tags = await TagRepository().get_tags_photos(list(photos), session)
+        comm = await get_comments_photos(list(photos), limit_comment, session)
+        return [{"photo": photos[photo_id], "tags": tags[photo_id], "comments": comm[photo_id]}
+                for photo_id in photo_ids if photo_id in photos]
+
+
     async def get_photo_by_id(self, photo_id: int, session: Session, limit_comment: int = 0) -> Optional[Photo]:
         """
         Retrieve a photo with the given photo_id associated with the user
@@ -231,25 +371,10 @@ class PhotosRepository:
         Raises:
             HTTPException: If the photo is not found.
         """
-        photo = session.query(Photo.id,
-                              Photo.file_url,
-                              Photo.qr_url,
-                              Photo.description,
-                              Photo.created_at,
-                              Photo.user_id,
-                              User.username
-                            ) \
-                    .select_from(Photo) \
-                    .join(User) \
-                    .filter(Photo.id == photo_id) \
-                    .first()
-
-        if not photo:
+        photos = await self.get_photos_by_ids(photo_ids=[photo_id], session=session, limit_comment=limit_comment)
+        if not photos:
             raise HTTPException(status.HTTP_404_NOT_FOUND, detail=messages.PHOTO_NOT_FOUND)
-
-        tags = await TagRepository().get_tags_photo(photo_id, session)
-        comm = await get_comments(page=1, per_page=limit_comment, photo_id=photo.id, db=session)
-        return {"photo": photo, "tags": tags, "comments": comm}
+        return photos[0]
 
 
     async def update_photo_description(self, photo_id: int, description: str,
@@ -273,53 +398,45 @@ class PhotosRepository:
             .values({"description": description})
             .returning(Photo)
         )
-        photo = session.execute(query).scalar_one_or_none()
+        photo = (await db_execute(session, query)).scalar_one_or_none()
 
         if not photo:
             raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Photo not found")
         elif photo.user_id != current_user.id and current_user.roles != UserRole.admin:
-            session.rollback()
+            await db_rollback(session)
             raise HTTPException(status.HTTP_403_FORBIDDEN, detail=messages.OPERATION_NOT_AVAILABLE)
 
-        session.commit()
+        await db_commit(session)
         tags = await TagRepository().get_tags_photo(photo_id, session)
         return {"photo": photo, "tags": tags}
 
 
-    async def get_all_photos(self, page: int, per_page: int, session: Session) -> List[Photo]:
+    async def get_all_photos(self, page: int, per_page: int, session: Session, limit_comment: int = MAX_TAGS_COUNT,
+                             cursor: str = None):
         """
         Retrieve a list of photos with pagination, sorted from newest to oldest
         Args:
             page (int): The current page.
             per_page (int): The number of photos per page.
             session: The database session
+            limit_comment (int): The number of latest comments per photo (0 - all comments).
+            cursor (str): The keyset cursor of the neighbouring page (next_cursor/prev_cursor).
         Returns:
-            List[Photo]: The list of photos
+            (List[dict], List[dict]): The list of photos of the page and the pages navigation
         """
-        result = []
-        offset = (page - 1) * per_page
-
-        photos = session.query(Photo.id,
-                               Photo.file_url,
-                               Photo.qr_url,
-                               Photo.description,
-                               Photo.created_at,
-                               Photo.user_id,
-                               User.username
-                              ) \
-                    .select_from(Photo) \
-                    .join(User) \
-                    .all()
-
-        for photo in photos:
-            tags = tags = await TagRepository().get_tags_photo(photo.id, session)
-            comm = await get_comments(page=0, per_page=0, photo_id=photo.id, db=session)
-            result.append({"photo": photo, "tags": tags, "comments": comm})
-
-        return result
+        photos_query = select(Photo.id, Photo.created_at)
+
+        paginate = Pagination(photos_query, session, page, per_page,
+                              keys=[Photo.created_at, Photo.id], cursor=cursor, estimate=True)
+        photos, pages = await paginate.get_page()
+        result = await self.get_photos_by_ids(photo_ids=[photo.id for photo in photos],
+                                              session=session,
+                                              limit_comment=limit_comment)
+        return result, pages
 
 
-    async def get_photos_by_user(self, user_id: int | None, current_user: User, page: int, per_page: int, session: Session) -> List[Photo]:
+    async def get_photos_by_user(self, user_id: int | None, current_user: User, page: int, per_page: int, session: Session,
+                                 limit_comment: int = MAX_TAGS_COUNT, cursor: str = None):
         """
         Retrieve a list of photos uploaded by a specific user with pagination, sorted from newest to oldest
         Args:
@@ -327,58 +444,48 @@ class PhotosRepository:
             page (int): The current page.
             per_page (int): The number of photos per page.
             session: The database session
+            limit_comment (int): The number of latest comments per photo (0 - all comments).
+            cursor (str): The keyset cursor of the neighbouring page (next_cursor/prev_cursor).
         Returns:
-            List[Photo]: The list of photos uploaded by the user
+            (List[dict], List[dict]): The list of photos of the page and the pages navigation
         """
-        result = []
-        offset = (page - 1) * per_page
         if user_id is None:
             user_id = current_user.id
 
-        photos = session.query(Photo.id,
-                               Photo.file_url,
-                               Photo.qr_url,
-                               Photo.description,
-                               Photo.created_at,
-                               Photo.user_id,
-                               User.username
-                              ) \
-                    .select_from(Photo) \
-                    .join(User) \
-                    .filter(Photo.user_id == user_id) \
-                    .all()
-
-        for photo in photos:
-            tags = tags = await TagRepository().get_tags_photo(photo.id, session)
-            comm = await get_comments(page=0, per_page=0, photo_id=photo.id, db=session)
-            result.append({"photo": photo, "tags": tags, "comments": comm})
+        photos_query = select(Photo.id, Photo.created_at) \
+                        .where(Photo.user_id == user_id)
 
-        return result
+        paginate = Pagination(photos_query, session, page, per_page,
+                              keys=[Photo.created_at, Photo.id], cursor=cursor)
+        photos, pages = await paginate.get_page()
+        result = await self.get_photos_by_ids(photo_ids=[photo.id for photo in photos],
+                                              session=session,
+                                              limit_comment=limit_comment)
+        return result, pages
 
 
     async def get_transform_photos(self, photo_id, session: Session):
-        photo_transforms = session.query(PhotoURL) \
-                                .filter(PhotoURL.photo_id == photo_id) \
-                                .all()
+        query = select(PhotoURL).where(PhotoURL.photo_id == photo_id)
+        photo_transforms = (await db_execute(session, query)).scalars().all()
         return photo_transforms
 
 
     async def get_transform_photo(self, photo_id, transform_id, session: Session):
-        photo_transform = session.query(PhotoURL) \
-                                .filter(and_(PhotoURL.photo_id == photo_id, PhotoURL.id == transform_id)) \
-                                .first()
+        query = select(PhotoURL).where(and_(PhotoURL.photo_id == photo_id, PhotoURL.id == transform_id))
+        photo_transform = (await db_execute(session, query)).scalars().first()
         return photo_transform
 
 
     async def upload_transform_photo(self, body: PhotoTransformModel, photo: Photo, db: Session) -> Photo:
 
-        url_changed_photo = CloudImage.upload_transform_image(body, photo.file_url)
+        url_changed_photo = storage.upload_transform_image(body, photo.file_url)
         # print(f">>> UpLoad_transform: {url_changed_photo}")
         err = await Validator().check_transform_url(url_changed_photo)
         if err:
             raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=err)
 
-        photourl = db.query(PhotoURL).filter(PhotoURL.file_url == url_changed_photo).first()
+        query = select(PhotoURL).where(PhotoURL.file_url == url_changed_photo)
+        photourl = (await db_execute(db, query)).scalars().first()
         if photourl:
             return photourl
         
@@ -388,12 +495,12 @@ class PhotosRepository:
             # print(f">>> UpLoad_transform: {params}")
 
             new_photo = PhotoURL(file_url=url_changed_photo,
-                                 photo=photo,
+                                 photo_id=photo.id,
                                  params=params
                                 )
             db.add(new_photo)
-            db.commit()
-            db.refresh(new_photo)
+            await db_commit(db)
+            await db_refresh(db, new_photo)
         except Exception as err:
             s = str(err)
             ind = s.find("\n")
@@ -407,13 +514,14 @@ class PhotosRepository:
     async def update_transform_photo(self, body: PhotoTransformModel, photo: Photo, trans_photo: PhotoURL,
                                      db: Session) -> Photo:
 
-        url_changed_photo = CloudImage.upload_transform_image(body, photo.file_url)
+        url_changed_photo = storage.upload_transform_image(body, photo.file_url)
         # print(f">>> update_transform: {url_changed_photo}")
         err = await Validator().check_transform_url(url_changed_photo)
         if err:
             raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=err)
 
-        photourl = db.query(PhotoURL).filter(PhotoURL.file_url == url_changed_photo).first()
+        query = select(PhotoURL).where(PhotoURL.file_url == url_changed_photo)
+        photourl = (await db_execute(db, query)).scalars().first()
         if photourl:
             return photourl
         
@@ -423,14 +531,14 @@ class PhotosRepository:
             # print(f">>> update_transform: {params}")
 
             if trans_photo.params != params and trans_photo.qr_url:     # Изменился URL и есть старый QR
-                result = CloudImage.delete_image(trans_photo.qr_url)    # Удалить QR
+                result = await release_qrcode(trans_photo.qr_url, db)    # Удалить QR
                 if result:
                     raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
                 trans_photo.qr_url = None
 
             trans_photo.file_url = url_changed_photo
             trans_photo.params = params
-            db.commit()
+            await db_commit(db)
         except Exception as err:
             s = str(err)
             ind = s.find("\n")
@@ -441,41 +549,21 @@ class PhotosRepository:
         return trans_photo
 
 
-    async def update_qr_url(self, body: PhotoQRCodeModel, photo: Photo | PhotoURL, is_transform: bool=False) -> str:
-        qr_name = f"c{photo.id}" if is_transform else f"b{photo.id}"
-        qr_extension = "png"
-
-        qr_os_folder = "./temp_qr_photo"
-        qr_os_path = f"{qr_os_folder}/{qr_name}.{qr_extension}"
-
-        cl_math = re.search(r"/v\d+/(.+)/\w+\.\w+$", photo.file_url)
-        if not cl_math:
-            cl_math = re.search(r"/v\d+/(.+)/\w+$", photo.file_url)
-        ci_folder = cl_math.group(1)
+    async def update_qr_url(self, body: PhotoQRCodeModel, photo: Photo | PhotoURL, db: Session,
+                            render=render_qrcode_async) -> str:
+        ci_folder = storage.get_folder(photo.file_url)
+        if not ci_folder:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=messages.STORAGE_FOLDER_NOT_FOUND)
         qr_ci_folder = f"{ci_folder}/qr"
-
-        if not await aiofiles.os.path.exists(qr_os_folder):
-            await aiofiles.os.mkdir(qr_os_folder)
-
-        qr = qrcode.QRCode()
-        qr.add_data(photo.file_url)
-        qr.make(fit=True)
-
-        img = qr.make_image(fill_color=body.fill_color, back_color=body.back_color)
-        img.save(qr_os_path)
-
-        photo_qr_url = CloudImage.upload_qrcode(qr_os_path, qr_ci_folder, qr_name)
-
-        await aiofiles.os.remove(qr_os_path)
-        return photo_qr_url
+        return await acquire_qrcode(photo.file_url, body.fill_color, body.back_color, qr_ci_folder, db, render)
 
 
     async def update_photo_qr_url(self, body: PhotoQRCodeModel, photo: Photo | PhotoURL,
                                   db: Session) -> Photo | PhotoURL:
         if not photo.qr_url:
-            photo_qr_url = await self.update_qr_url(body, photo)
+            photo_qr_url = await self.update_qr_url(body, photo, db)
             photo.qr_url = photo_qr_url
-            db.commit()
+            await db_commit(db)
 
         # tags = await TagRepository().get_tags_photo(photo.id, db)
         # return {"photo": photo, "tags": tags}
@@ -485,15 +573,15 @@ class PhotosRepository:
     async def update_transphoto_qr_url(self, body: PhotoQRCodeModel, photo: Photo | PhotoURL,
                                         db: Session) -> Photo | PhotoURL:
         if not photo.qr_url:
-            photo_qr_url = await self.update_qr_url(body, photo, True)
+            photo_qr_url = await self.update_qr_url(body, photo, db)
             photo.qr_url = photo_qr_url
-            db.commit()
+            await db_commit(db)
         return photo
 
 
     async def delete_transform_photo(self, photo: PhotoURL, db: Session) -> None:
 
-        db.delete(photo)
+        await db_delete(db, photo)
 
         # result = CloudImage.delete_image(photo.file_url)
         # if result:
@@ -501,20 +589,21 @@ class PhotosRepository:
         #     raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
 
         if photo.qr_url:
-            result = CloudImage.delete_image(photo.qr_url)
+            result = await release_qrcode(photo.qr_url, db)
             if result:
-                db.rollback()
+                await db_rollback(db)
                 raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
 
-        db.commit()
+        await db_commit(db)
 
 
     async def delete_all_transform_photo(self, photo: Photo, db: Session, is_commit: bool=True) -> None:
 
-        photos_to_del = db.query(PhotoURL).filter(PhotoURL.photo_id == photo.id).all()
+        query = select(PhotoURL).where(PhotoURL.photo_id == photo.id)
+        photos_to_del = (await db_execute(db, query)).scalars().all()
 
         query = delete(PhotoURL).where(PhotoURL.photo_id == photo.id)
-        db.execute(query)
+        await db_execute(db, query)
 
         for one_photo in photos_to_del:
             # result = CloudImage.delete_image(one_photo.file_url)
@@ -523,11 +612,11 @@ class PhotosRepository:
             #     raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
 
             if one_photo.qr_url:
-                result = CloudImage.delete_image(one_photo.qr_url)
+                result = await release_qrcode(one_photo.qr_url, db)
                 if result:
-                    db.rollback()
+                    await db_rollback(db)
                     raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=result)
 
         if is_commit:
-            db.commit()
+            await db_commit(db)
 
@@ -0,0 +1,69 @@
+import hashlib
+
+from sqlalchemy import update, delete
+from sqlalchemy.orm import Session
+
+from src.database.db import db_execute, db_insert
+from src.database.models import QRCode
+from src.services.qr_code import render_qrcode_async
+from src.services.storage import storage
+
+
+def get_qrcode_hash(data: str, fill_color: str, back_color: str) -> str:
+    """
+    The content hash of a QR code: the image depends only on the data and the colors.
+    """
+    return hashlib.sha256(f"{data}\n{fill_color}\n{back_color}".encode()).hexdigest()
+
+
+async def acquire_qrcode(data: str, fill_color: str, back_color: str, folder: str, db: Session,
+                         render=render_qrcode_async) -> str:
+    """
+    Returns the URL of the QR code of the data and counts one more reference to it.
+    The QR code is rendered and uploaded only if there is no stored QR code with the same content hash.
+
+    Args:
+        data (str): The data of the QR code (URL of the photo).
+        fill_color (str): The color of the QR code.
+        back_color (str): The background color.
+        folder (str): The storage folder for a new QR code.
+        db (Session): The database session, the caller commits.
+        render: The coroutine function rendering the PNG of a new QR code (data, fill_color, back_color).
+
+    Returns:
+        str: The URL of the QR code.
+    """
+    qr_hash = get_qrcode_hash(data, fill_color, back_color)
+    query = update(QRCode).where(QRCode.hash == qr_hash).values(ref_count=QRCode.ref_count + 1).returning(QRCode.url)
+    url = (await db_execute(db, query)).scalar_one_or_none()
+    if url:
+        return url
+
+    qr_image = await render(data, fill_color, back_color)
+    url = await storage.upload_qrcode(qr_image, folder, qr_hash)
+    # a concurrent request may have stored the same QR code meanwhile, then its row gets the reference
+    query = db_insert(db, QRCode).values(hash=qr_hash, url=url, ref_count=1)
+    query = query.on_conflict_do_update(index_elements=[QRCode.hash], set_={"ref_count": QRCode.ref_count + 1})
+    return (await db_execute(db, query.returning(QRCode.url))).scalar_one()
+
+
+async def release_qrcode(url: str, db: Session) -> str:
+    """
+    Drops one reference to the QR code, the image is deleted from the storage with the last reference.
+    QR codes created before the cache are not counted and are deleted at once.
+
+    Args:
+        url (str): The URL of the QR code.
+        db (Session): The database session, the caller commits.
+
+    Returns:
+        str: "" on success or the error message of the storage.
+    """
+    query = update(QRCode).where(QRCode.url == url).values(ref_count=QRCode.ref_count - 1).returning(QRCode.ref_count)
+    ref_count = (await db_execute(db, query)).scalar_one_or_none()
+    if ref_count is not None and ref_count > 0:
+        return ""
+
+    if ref_count is not None:
+        await db_execute(db, delete(QRCode).where(QRCode.url == url))
+    return await storage.delete_image(url)
@@ -1,9 +1,11 @@
-from typing import List
+from typing import List, Dict
 
-from sqlalchemy import select, insert, func, desc
+from sqlalchemy import select, insert, update, desc
 from sqlalchemy.orm import Session
 
+from src.database.db import db_execute, db_commit, db_insert, db_after_commit
 from src.database.models import Tag, tag_photo_association as t2p
+from src.services.tag_index import tag_index
 
 
 class TagRepository:
@@ -21,52 +23,122 @@ class TagRepository:
             Tag: The existing or newly created Tag object.
         """
         query = select(Tag).where(Tag.name == tag_name)
-        tag = session.execute(query).scalar_one_or_none()
+        tag = (await db_execute(session, query)).scalar_one_or_none()
         if tag:
             return tag
         query_ = insert(Tag).values(name=tag_name).returning(Tag)
-        new_tag = session.execute(query_).scalar_one()
-        session.commit()
+        new_tag = (await db_execute(session, query_)).scalar_one()
+        self.index_new_tags([new_tag], session)
+        await db_commit(session)
         return new_tag
 
 
     async def add_tags_to_photo(self, tags: List[str], photo_id: int, session: Session, is_commit: bool=True) -> List[Tag]:
         """
-        Add tags to a photo
+        Add tags to a photo with a constant number of statements: new tag names are inserted
+        with ON CONFLICT DO NOTHING, the other tags are selected, and the links to the photo are
+        inserted in bulk skipping the existing ones. Concurrent uploads with the same new tag do not fail.
         Args:
-            tags_str (str): A string containing tags separated by commas.
+            tags (List[str]): The names of the tags.
             photo_id: The ID of the photo to which tags will be added.
             session: The database session
         Returns:
             List[Tag]: The list of tags added to the photo
         """
-        result = []
-        for tag in tags:
-            query = select(Tag).where(Tag.name == tag)
-            tag_ = session.execute(query).scalar_one_or_none()
-            if not tag_:
-                query_ = insert(Tag).values(name=tag).returning(Tag)
-                tag_ = session.execute(query_).scalar_one()
-            
-            try:
-                query = insert(t2p).values(tag_id=tag_.id, photo_id=photo_id).returning(t2p)
-                add_tag_to_db = session.execute(query)
-            except Exception as err:
-                if str(err).find("duplicate key") < 0:
-                    raise
-                
-            result.append(tag_)
+        names = list(dict.fromkeys(tag for tag in tags if tag))
+        if not names:
+            return []
+
+        query = db_insert(session, Tag).values([{"name": name} for name in names]) \
+            .on_conflict_do_nothing(index_elements=[Tag.name]) \
+            .returning(Tag)
+        tags_ = {tag.name: tag for tag in (await db_execute(session, query)).scalars().all()}
+        self.index_new_tags(tags_.values(), session)
+
+        existing = [name for name in names if name not in tags_]
+        if existing:
+            query = select(Tag).where(Tag.name.in_(existing))
+            tags_.update({tag.name: tag for tag in (await db_execute(session, query)).scalars().all()})
+
+        result = [tags_[name] for name in names if name in tags_]
+        query = db_insert(session, t2p).values([{"tag_id": tag.id, "photo_id": photo_id} for tag in result]) \
+            .on_conflict_do_nothing() \
+            .returning(t2p.c.tag_id)
+        added = (await db_execute(session, query)).scalars().all()
+        await self.update_photo_count(added, 1, session)
+
         if is_commit:
-            session.commit()
+            await db_commit(session)
         return result
 
 
+    async def update_photo_count(self, tag_ids: List[int], delta: int, session: Session) -> None:
+        """
+        Change the number of photos of the tags in the transaction which links or unlinks them.
+        Args:
+            tag_ids: The IDs of the tags.
+            delta: +1 for linked photos, -1 for unlinked photos.
+            session: The database session, the caller commits.
+        """
+        if not tag_ids:
+            return
+        query = update(Tag).where(Tag.id.in_(tag_ids)).values(photo_count=Tag.photo_count + delta)
+        await db_execute(session, query)
+        tag_ids = list(tag_ids)
+        db_after_commit(session, lambda: tag_index.update_counts(tag_ids, delta))
+
+
+    async def unlink_photo_tags(self, photo_id: int, session: Session) -> None:
+        """
+        Decrease the number of photos of all tags of a photo, which is about to be deleted
+        (its links are deleted by the cascade of the foreign key).
+        Args:
+            photo_id: The ID of the photo.
+            session: The database session, the caller commits.
+        """
+        tag_ids = select(t2p.c.tag_id).where(t2p.c.photo_id == photo_id)
+        query = update(Tag).where(Tag.id.in_(tag_ids)).values(photo_count=Tag.photo_count - 1).returning(Tag.id)
+        unlinked = (await db_execute(session, query)).scalars().all()
+        db_after_commit(session, lambda: tag_index.update_counts(unlinked, -1))
+
+
+    def index_new_tags(self, tags, session: Session) -> None:
+        """
+        Add new tags to the autocomplete index when the transaction which created them is committed.
+        Args:
+            tags: The new Tag objects.
+            session: The database session.
+        """
+        rows = [(tag.id, tag.name, tag.photo_count) for tag in tags]
+        if rows:
+            db_after_commit(session, lambda: tag_index.add(rows))
+
+
     async def get_tags_photo(self, photo_id: int, session: Session) -> List[Tag]:
         tquery = select(Tag).join(t2p).where(Tag.id == t2p.c.tag_id).where(t2p.c.photo_id == photo_id)
-        tags = session.execute(tquery).scalars().all()
+        tags = (await db_execute(session, tquery)).scalars().all()
         return tags 
 
 
+    async def get_tags_photos(self, photo_ids: List[int], session: Session) -> Dict[int, List[Tag]]:
+        """
+        Get tags of several photos in a single query
+        Args:
+            photo_ids: The IDs of the photos.
+            session: The database session
+        Returns:
+            Dict[int, List[Tag]]: The lists of tags keyed by photo ID
+        """
+        result = {photo_id: [] for photo_id in photo_ids}
+        if not photo_ids:
+            return result
+
+        tquery = select(Tag, t2p.c.photo_id).join(t2p, Tag.id == t2p.c.tag_id).where(t2p.c.photo_id.in_(photo_ids))
+        for tag, photo_id in (await db_execute(session, tquery)).all():
+            result[photo_id].append(tag)
+        return result
+
+
     async def get_different_tags(self, tags: List[str], tags_photo: List[Tag]) -> (List[str], List[str]):
         diff_list = tags
         tags_list = []
@@ -85,19 +157,18 @@ class TagRepository:
     async def get_tags_all(self, session: Session) -> List[Tag]:
         # tquery = select(Tag)
         # tags = session.execute(tquery).scalars().all()
-        tags = session.query(Tag) \
-                      .order_by(Tag.name) \
-                      .all()
+        tquery = select(Tag).order_by(Tag.name)
+        tags = (await db_execute(session, tquery)).scalars().all()
         return tags 
 
 
     async def get_tags_max10(self, session: Session) -> List[Tag]:
-        tags = session.query(Tag.id,
-                             Tag.name,
-                             func.count(Tag.id).label('tag_count')) \
-                        .select_from(Tag) \
-                        .join(t2p) \
-                        .group_by(Tag.id, Tag.name) \
-                        .order_by(desc("tag_count")) \
-                        .limit(10).all()
+        # photo_count is maintained with the links, so this is a scan of the ix_tags_photo_count index
+        tquery = select(Tag.id,
+                        Tag.name,
+                        Tag.photo_count.label('tag_count')) \
+                    .where(Tag.photo_count > 0) \
+                    .order_by(desc(Tag.photo_count)) \
+                    .limit(10)
+        tags = (await db_execute(session, tquery)).all()
         return tags 
@@ -6,13 +6,14 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_, select
 from sqlalchemy.exc import SQLAlchemyError
 
-from src.database.db import DBSession
+from src.database.db import DBSession, db_execute, db_commit, db_refresh
 from src.database.models import User, UserRole, Photo
 from src.schemas import UserModel, UserDbResponse, UserDbAdmin
 from src.services.pager import Pagination
+from src.services.user_cache import forget_user
 
 
-async def get_users(per_page: int, page: int, session: Session) -> List[UserDbAdmin]:
+async def get_users(per_page: int, page: int, session: Session, cursor: str = None) -> List[UserDbAdmin]:
     # res = session.query(User.id, 
     #                     User.username,
     #                     User.email,
@@ -39,14 +40,14 @@ async def get_users(per_page: int, page: int, session: Session) -> List[UserDbAd
             .join(Photo, isouter=True) \
             .group_by(User.id, User.username, User.email, User.created_at, User.avatar, User.roles, User.confirmed, User.is_banned) 
     # print('>>> get_users(select): ', sel)
-    paginate = Pagination(sel, session, page, per_page)
-    res, pages = paginate.get_page()
+    paginate = Pagination(sel, session, page, per_page, keys=[User.id], descending=False, cursor=cursor)
+    res, pages = await paginate.get_page()
     # res = session.execute(sel).all()
     # print('>>> get_users(result): ', res)
     return res, pages
 
 
-async def get_users_by_mask(per_page: int, page: int, search_mask:str, session: Session) -> List[UserDbAdmin]:
+async def get_users_by_mask(per_page: int, page: int, search_mask:str, session: Session, cursor: str = None) -> List[UserDbAdmin]:
     sel_users = select( User.id, 
                         User.username,
                         User.email,
@@ -60,42 +61,44 @@ async def get_users_by_mask(per_page: int, page: int, search_mask:str, session:
                 .join(Photo, isouter=True) \
                 .filter(or_(User.username.like(search_mask), User.email.like(search_mask)))\
                 .group_by(User.id, User.username, User.email, User.created_at, User.avatar, User.roles, User.confirmed, User.is_banned)
-    paginate = Pagination(sel_users, session, page, per_page)
-    res, pages = paginate.get_page()
+    paginate = Pagination(sel_users, session, page, per_page, keys=[User.id], descending=False, cursor=cursor)
+    res, pages = await paginate.get_page()
     return res, pages
 
 
 async def toggle_banned_user(user_id: int, db: Session) -> UserDbAdmin:
-    user = db.query(User).filter(User.id == user_id).first()
+    user = (await db_execute(db, select(User).where(User.id == user_id))).scalars().first()
     if user:
         user.is_banned = not user.is_banned
-        db.commit()
+        await db_commit(db)
+        forget_user(user.email)
     return await get_user_by_id(user_id, db)
 
 
 async def set_roles_user(user_id: int, role: UserRole, db: Session) -> UserDbAdmin:
-    user = db.query(User).filter(User.id == user_id).first()
+    user = (await db_execute(db, select(User).where(User.id == user_id))).scalars().first()
     if user:
         user.roles = role
-        db.commit()
+        await db_commit(db)
+        forget_user(user.email)
     return await get_user_by_id(user_id, db)
 
 
 async def get_user_by_id(user_id: int, session: Session) -> UserDbAdmin:
-    res = session.query(User.id.label('id'), 
-                        User.username.label('username'),
-                        User.email.label('email'),
-                        User.created_at.label('created_at'),
-                        User.avatar.label('avatar'),
-                        User.roles.label('roles'),
-                        User.confirmed.label('confirmed'),
-                        User.is_banned.label('is_banned'),
-                        func.count(Photo.user_id).label('photo_count')) \
-                .select_from(User) \
-                .join(Photo, isouter=True) \
-                .filter(User.id == user_id) \
-                .group_by(User.id, User.username, User.email, User.created_at, User.avatar, User.roles, User.confirmed, User.is_banned) \
-                .first()
+    sel = select(User.id.label('id'), 
+                 User.username.label('username'),
+                 User.email.label('email'),
+                 User.created_at.label('created_at'),
+                 User.avatar.label('avatar'),
+                 User.roles.label('roles'),
+                 User.confirmed.label('confirmed'),
+                 User.is_banned.label('is_banned'),
+                 func.count(Photo.user_id).label('photo_count')) \
+            .select_from(User) \
+            .join(Photo, isouter=True) \
+            .filter(User.id == user_id) \
+            .group_by(User.id, User.username, User.email, User.created_at, User.avatar, User.roles, User.confirmed, User.is_banned)
+    res = (await db_execute(session, sel)).first()
     return res
 
 
@@ -109,7 +112,7 @@ async def get_user_by_email(email: str, db: Session) -> User:
     :doc-author: Python-WEB13-project-team-2
     """
     # print(f">>> get_user_by_email: {email}")
-    res = db.query(User).filter(User.email == email).first()
+    res = (await db_execute(db, select(User).where(User.email == email))).scalars().first()
     # res = db.query(User.id.label('id'), 
     #                 User.username.label('username'),
     #                 User.email.label('email'),
@@ -151,8 +154,8 @@ async def create_user(body: UserModel, db: Session) -> User:
         avatar = ""
     new_user = User(username=body.username, email=body.email, password=body.password, avatar=avatar)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db_commit(db)
+    await db_refresh(db, new_user)
     return new_user
 
 
@@ -167,7 +170,8 @@ async def update_token(user: User, token: str | None, db: Session) -> None:
     :doc-author: Python-WEB13-project-team-2
     """
     user.refresh_token = token
-    db.commit()
+    await db_commit(db)
+    forget_user(user.email)
 
 
 async def confirmed_email(email: str, db: Session) -> None:
@@ -181,7 +185,8 @@ async def confirmed_email(email: str, db: Session) -> None:
     """
     user = await get_user_by_email(email, db)
     user.confirmed = True
-    db.commit()
+    await db_commit(db)
+    forget_user(user.email)
 
 
 async def update_avatar(user: User, url: str, db: Session) -> UserDbResponse:
@@ -200,22 +205,23 @@ async def update_avatar(user: User, url: str, db: Session) -> UserDbResponse:
     :doc-author: Python-WEB13-project-team-2
     """
     user.avatar = url
-    db.commit()
+    await db_commit(db)
+    forget_user(user.email)
     return await get_user_info(user.id, db)
 
 
 async def get_user_info(user_id: int, session: Session) -> UserDbResponse:
-    res = session.query(User.id, 
-                        User.username,
-                        User.email,
-                        User.created_at,
-                        User.avatar,
-                        User.roles,
-                        func.count(Photo.user_id).label('photo_count')) \
-                .select_from(User) \
-                .join(Photo, isouter=True) \
-                .filter(User.id == user_id) \
-                .group_by(User.id, User.username, User.email, User.created_at, User.avatar, User.roles) \
-                .first()
+    sel = select(User.id, 
+                 User.username,
+                 User.email,
+                 User.created_at,
+                 User.avatar,
+                 User.roles,
+                 func.count(Photo.user_id).label('photo_count')) \
+            .select_from(User) \
+            .join(Photo, isouter=True) \
+            .filter(User.id == user_id) \
+            .group_by(User.id, User.username, User.email, User.created_at, User.avatar, User.roles)
+    res = (await db_execute(session, sel)).first()
     return res
     
\ No newline at end of file
@@ -4,8 +4,8 @@ from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredent
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 
-from src.base import app, templates
-from src.database.db import get_db
+from src.base import templates, get_request_user, set_request_user
+from src.database.db import get_async_db
 from src.database.models import User
 from src.schemas import UserModel, UserResponse, TokenModel, LoginModel, LoginResponse, RequestEmail, UserDb
 from src.repository import users as repository_users
@@ -23,17 +23,18 @@ security = HTTPBearer()
 
 
 @router.get("/signup", response_class=HTMLResponse, description="Sign Up", dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def register(request: Request):
+async def register(request: Request, db: Session = Depends(get_async_db)):
+    await repository_auth().check_authentication(request=request, db=db)
     return templates.TemplateResponse("auth/signup.html", {"request": request,
                                                            "title": messages.CONTACTS_APP, 
-                                                           "user": app.extra["user"]})
+                                                           "user": get_request_user(request)})
 
 
 @router.post("/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def signup(body: UserModel,
                  background_tasks: BackgroundTasks, 
                  request: Request, 
-                 db: Session = Depends(get_db)):
+                 db: Session = Depends(get_async_db)):
     """
     The signup function creates a new user in the database.
         - It also sends an email to the user's email address for confirmation.
@@ -68,7 +69,7 @@ async def signup(body: UserModel,
 async def login_user(request: Request,
                      response: Response, 
                      body: LoginModel, 
-                     db: Session = Depends(get_db)):
+                     db: Session = Depends(get_async_db)):
     """
     The login function is used to authenticate a user.
     
@@ -104,9 +105,9 @@ async def login_user(request: Request,
 
     user = await repository_users.get_user_by_id(user.id, db)
     log_user = Jsons.userresponse_to_json(user=user, auth=True)
-    app.extra.update({"user": log_user})
+    set_request_user(request, log_user)
 
-    return {"user": app.extra["user"], "detail": {"success": [{"key": "message", "value": messages.LOGIN_SUCCESSFUL},
+    return {"user": get_request_user(request), "detail": {"success": [{"key": "message", "value": messages.LOGIN_SUCCESSFUL},
                                                               {"key": "access_token", "value": f"Bearer {access_token}"},
                                                               {"key": "refresh_token", "value": f"Bearer {refresh_token}"},
                                                               {"key": "reload", "value": "/"}]}}
@@ -115,7 +116,7 @@ async def login_user(request: Request,
 @router.post("/logout")
 async def logout_user(request: Request,
                       response: Response, 
-                      db: Session = Depends(get_db)):
+                      db: Session = Depends(get_async_db)):
     message = ""
     check_auth = repository_auth()
     current_user = await check_auth.check_authentication(request=request, db=db, is_logout=True)
@@ -129,7 +130,7 @@ async def logout_user(request: Request,
 
 
 @router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(request: Request, credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(request: Request, credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_async_db)):
     """
     The refresh_token function is used to refresh the access token.
         It takes in a refresh token and returns a new access_token, refresh_token, and token type.
@@ -154,7 +155,7 @@ async def refresh_token(request: Request, credentials: HTTPAuthorizationCredenti
 
 
 @router.get('/confirmed_email/{token}')
-async def confirmed_email(request: Request, token: str, db: Session = Depends(get_db)):
+async def confirmed_email(request: Request, token: str, db: Session = Depends(get_async_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
         - It takes the token from the URL and uses it to get the user's email address.
@@ -168,9 +169,10 @@ async def confirmed_email(request: Request, token: str, db: Session = Depends(ge
     :return: A dict with a message
     :doc-author: Python-WEB13-project-team-2
     """
+    await repository_auth().check_authentication(request=request, db=db)
     response_dict = {"request": request,
                      "title": messages.CONTACTS_APP,
-                     "user": app.extra["user"]}
+                     "user": get_request_user(request)}
     errors = {}
     try:
         email = auth_service.get_email_from_token(token)
@@ -193,7 +195,7 @@ async def confirmed_email(request: Request, token: str, db: Session = Depends(ge
 
 @router.post('/request_email')
 async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
-                        db: Session = Depends(get_db)):
+                        db: Session = Depends(get_async_db)):
     """
     The request_email function is used to send an email to the user with a link that will allow them
     to confirm their email address. The function takes in a RequestEmail object, which contains the
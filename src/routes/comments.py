@@ -4,11 +4,11 @@ from fastapi import APIRouter, HTTPException, Depends, status, Request
 # from fastapi_limiter.depends import RateLimiter
 from sqlalchemy.orm import Session
 
-from src.base import app, templates
+from src.base import templates, get_request_user
 from src.schemas import CommentModel, CommentUpdate, CommentDelete, CommentResponse
 from src.conf import messages
 from src.repository import comments as repository_comments
-from src.database.db import get_db
+from src.database.db import get_async_db
 from src.database.models import User, UserRole
 from src.services.auth import auth_service
 from src.services.roles import RoleAccess
@@ -22,7 +22,7 @@ allowed_operation_nouser = RoleAccess([UserRole.admin, UserRole.moderator])
 
 
 @router.get('/{photo_id}/comments', response_model=List[CommentResponse])
-async def get_comments(photo_id: int, db: Session = Depends(get_db)):
+async def get_comments(photo_id: int, db: Session = Depends(get_async_db)):
     comments = await repository_comments.get_comments(photo_id, db)
     return comments
 
@@ -32,12 +32,12 @@ async def create_comment(request: Request,
                          photo_id: int,
                          body: CommentModel,
                          user: User = Depends(auth_service.get_current_user),
-                         db: Session = Depends(get_db)):
+                         db: Session = Depends(get_async_db)):
     comment = await repository_comments.create_comment(photo_id, body, user, db)
     # return comment
     return templates.TemplateResponse('photo/photo.html', {"request": request,
                                                            "title": messages.CONTACTS_APP, 
-                                                           "user": app.extra["user"],
+                                                           "user": get_request_user(request),
                                                            "comment": Jsons.commentresponse_to_json(comment)})
 
 
@@ -47,7 +47,7 @@ async def update_comment(photo_id: int,
                          comment_id: int,
                          body: CommentModel,
                          user: User = Depends(auth_service.get_current_user),
-                         db: Session = Depends(get_db)):
+                         db: Session = Depends(get_async_db)):
     comment = await repository_comments.update_comment(photo_id, comment_id, body, user, db)
     return comment
 
@@ -58,6 +58,6 @@ async def update_comment(photo_id: int,
 async def delete_comment(photo_id: int,
                          comment_id: int,
                          user: User = Depends(auth_service.get_current_user),
-                         db: Session = Depends(get_db)):
+                         db: Session = Depends(get_async_db)):
     comment = await repository_comments.delete_comment(photo_id, comment_id, user, db)
     return comment
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse, RedirectResponse
+
+from src.conf import messages
+from src.conf.config import settings
+from src.services.custom_limiter import RateLimiter
+from src.services.storage import storage
+from src.services.qualifiers import QualifierError
+
+router = APIRouter(prefix="", tags=["media"])
+
+
+@router.get('/{path:path}', response_class=FileResponse,
+            dependencies=[Depends(RateLimiter(times=settings.transform_rate_limit, seconds=60))])
+async def get_transformed_image(path: str, tr: str = ""):
+    """
+    The get_transformed_image function serves a file of the local storage rendered with the
+    Cloudinary transformation string of the tr parameter. Rendered variants are cached on disk,
+    so only the first request of a variant renders it. The router is included only for the local storage.
+
+    :param path: str: The path of the file in the storage
+    :param tr: str: The transformation, e.g. c_fill,h_100,w_200/r_max
+    :return: The rendered image or the redirect to the URL of the storage which renders it
+    :doc-author: Python-WEB13-project-team-2
+    """
+    try:
+        image = await storage.render_transform(path, tr)
+    except QualifierError as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"{messages.INVALID_TRANSFORMATION}: {err}")
+    if isinstance(image, str):
+        # a storage rendering the transformations itself
+        return RedirectResponse(image)
+    return FileResponse(image, headers={"Cache-Control": "public, max-age=31536000, immutable"})
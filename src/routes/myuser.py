@@ -2,15 +2,15 @@ from fastapi import APIRouter, Depends, UploadFile, File, Request, Response, sta
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from src.base import app, templates
+from src.base import templates, get_request_user
 from src.conf import messages
-from src.database.db import get_db
+from src.database.db import get_async_db
 from src.database.models import User, Photo
 from src.repository import users as repository_users
 from src.repository.auth import Auth as repository_auth
 from src.services.auth import auth_service
 from src.schemas import UserDb, UserDbResponse, UserResponse
-from src.services.cloud_image import CloudImage
+from src.services.storage import storage
 from src.services.custom_json import Jsons
 
 
@@ -20,7 +20,7 @@ router = APIRouter(prefix="", tags=["myuser"])
 @router.get("/", response_model=UserDbResponse)
 async def read_users_me(request: Request,
                         # current_user: User = Depends(auth_service.get_current_user),
-                        db: Session = Depends(get_db)):
+                        db: Session = Depends(get_async_db)):
     """
     The read_users_me function returns the current user's information.
         get:
@@ -38,7 +38,7 @@ async def read_users_me(request: Request,
     if current_user:
         return templates.TemplateResponse("auth/profile.html", {"request": request,
                                                                 "title": messages.CONTACTS_APP, 
-                                                                "user": app.extra["user"]})
+                                                                "user": get_request_user(request)})
     return responses.RedirectResponse("/",
                                       status_code=status.HTTP_302_FOUND)
 
@@ -48,7 +48,7 @@ async def read_users_me(request: Request,
 async def update_avatar_user(request: Request,
                              file: UploadFile = File(),
                             #  current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+                             db: Session = Depends(get_async_db)):
     """
     The update_avatar_user function updates the avatar of a user.
         Args:
@@ -66,16 +66,17 @@ async def update_avatar_user(request: Request,
     if current_user:
         if current_user.avatar:
             # print(f">>> current_user.avatar: {current_user.avatar}")
-            result = CloudImage.delete_image(current_user.avatar)
+            result = await storage.delete_image(current_user.avatar)
             # if result:
             #     print(f"Update_Avatar_User: {result}")
 
-        src_url = CloudImage.upload_image(photo_file=file.file, user=current_user, folder=f"avatar/{current_user.username}")
+        src_url = await storage.upload_image(photo_file=file.file, user=current_user, folder=f"avatar/{current_user.username}",
+                                              filename=file.filename)
         user = await repository_users.update_avatar(current_user, src_url, db)
-        app.extra["user"].update({"avatar": src_url})
+        get_request_user(request).update({"avatar": src_url})
         # result = await repository_users.get_user_info(user.id, db)
         # return result
-        return {"user": app.extra["user"], "detail": {"success": [{"key": "reload", "value": "/"}]}}
+        return {"user": get_request_user(request), "detail": {"success": [{"key": "reload", "value": "/"}]}}
 
     return responses.RedirectResponse("/",
                                       status_code=status.HTTP_302_FOUND)
@@ -3,25 +3,27 @@ from typing import List, Optional
 from fastapi import APIRouter, Depends, UploadFile, File, Body, Query, HTTPException, status, Request, responses
 from fastapi.responses import JSONResponse, HTMLResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, select
 
-from src.base import app, templates
-from src.database.db import get_db
+from src.base import templates, get_request_user
+from src.database.db import get_async_db, db_execute
 from src.database.models import User, UserRole, Photo, PhotoURL
 from src.repository.auth import Auth as repository_auth
 from src.repository.photos import PhotosRepository
-from src.repository.tags import TagRepository
 from src.repository import comments as repository_comments
 from src.schemas import (PhotoResponse, PhotoUpdateModel, PhotoNewModel, PhotoExtResponse,
                          PhotoTransformModel, DetailResponse,
                          PhotoQRCodeModel, PhotoURLResponse, PhotoTransQRCodeModel, PhotoSearchModel,
-                         PhotoAddTagsModel, CommentModel, CommentResponse, TagDetail)
+                         PhotoAddTagsModel, CommentModel, CommentResponse, CommentPage, TagDetail,
+                         QRBatchJobResponse)
 from src.services.auth import auth_service
 from src.services.validators import Validator
 from src.services.roles import RoleAccess
 from src.services.custom_limiter import RateLimiter
 from src.services.custom_json import Jsons
+from src.services.qr_batch import start_qr_batch, get_qr_batch
 from src.conf import messages
+from src.conf.config import settings
 
 allowed_operation_all = RoleAccess([UserRole.admin, UserRole.moderator, UserRole.user])
 # allowed_operation = RoleAccess([UserRole.admin, UserRole.user])
@@ -36,13 +38,17 @@ async def get_and_search_photos(request: Request,
                                 user_id: int = Query(None, description="Filter by user"),
                                 keyword: str = Query(None, description="Keyword to search in photo descriptions"),
                                 tag: str = Query(None, description="Filter photos by tag"),
-                                order_by: str = Query("newest", description="Sort order date('newest' or 'oldest'"),
-                                db: Session = Depends(get_db)):
+                                order_by: str = Query("newest", description="Sort order date('newest' or 'oldest') or 'relevance' of keyword"),
+                                cursor: str = Query(None, description="Cursor of the neighbouring page"),
+                                tags: List[str] = Query(None, description="Filter photos by several tags"),
+                                tag_mode: str = Query("all", description="Tags filter mode ('all' or 'any' of tags)"),
+                                db: Session = Depends(get_async_db)):
 
     await repository_auth().check_authentication(request=request, db=db)
     # print(request.url)
     # print(f'page = {page}, per_page = {per_page}')
-    photos, pages = await PhotosRepository().search_photos(db, page, per_page, user_id, keyword, tag, order_by)
+    photos, pages = await PhotosRepository().search_photos(db, page, per_page, user_id, keyword, tag, order_by, cursor,
+                                                           tags, tag_mode)
     return photos, pages
 
 
@@ -50,15 +56,14 @@ async def get_and_search_photos(request: Request,
 # @router.get('/photo-add', response_model=List[TagDetail])
 async def new_photo(request: Request, 
                     #   current_user: User = Depends(auth_service.get_current_user),
-                    db: Session = Depends(get_db)):
+                    db: Session = Depends(get_async_db)):
     
     current_user = await repository_auth().check_authentication(request=request, db=db)
     if current_user:
-        tags = await TagRepository().get_tags_all(session=db)
+        # tags are suggested by the /api/tags/autocomplete endpoint
         return templates.TemplateResponse('photo/photo-add.html', {"request": request,
                                                                    "title": messages.CONTACTS_APP, 
-                                                                   "user": app.extra["user"],
-                                                                   "tags": Jsons.list_tagresponse_to_json(tags)})
+                                                                   "user": get_request_user(request)})
     return responses.RedirectResponse("/",
                                       status_code=status.HTTP_302_FOUND)
 
@@ -66,19 +71,23 @@ async def new_photo(request: Request,
 @router.get('/{photo_id}', response_model=PhotoResponse, response_class=HTMLResponse)
 async def get_photo_by_id(request: Request, 
                           photo_id: int,
-                          db: Session = Depends(get_db)):
+                          db: Session = Depends(get_async_db)):
     check_auth = repository_auth()
     current_user = await check_auth.check_authentication(request=request, db=db)
 
-    image = await PhotosRepository().get_photo_by_id(photo_id, db)
-    tags = await TagRepository().get_tags_all(session=db)
+    # the first page of the comments, the next pages are loaded from /{photo_id}/comments
+    image = await PhotosRepository().get_photo_by_id(photo_id, db, limit_comment=settings.comments_page_size)
+    comments = image["comments"]
+    comments_cursor = None
+    if comments and image["photo"].comment_count > len(comments):
+        comments_cursor = repository_comments.get_comments_cursor(comments[-1])
     transforms = await PhotosRepository().get_transform_photos(photo_id=photo_id, session=db)
     return templates.TemplateResponse('photo/photo.html', {"request": request,
                                                             "title": messages.CONTACTS_APP, 
-                                                            "user": app.extra["user"],
+                                                            "user": get_request_user(request),
                                                             "roles": UserRole,
                                                             "photo": Jsons.photoresponse_to_json(image),
-                                                            "tags": Jsons.list_tagresponse_to_json(tags),
+                                                            "comments_cursor": comments_cursor,
                                                             "transforms": Jsons.list_transformphotoresponse_to_json(transforms)})
 
 
@@ -88,7 +97,7 @@ async def upload_photo(request: Request,
                        body: PhotoNewModel = Body(...),
                        photo_file: UploadFile = File(...),
                     #    current_user: User = Depends(auth_service.get_current_user),
-                       db: Session = Depends(get_db)):
+                       db: Session = Depends(get_async_db)):
     url_redirect = "/"
     message = ""
     check_auth = repository_auth()
@@ -120,7 +129,7 @@ async def add_tag_to_photo(request: Request,
                            photo_id: int,
                            body: PhotoAddTagsModel,
                         #    current_user: User = Depends(auth_service.get_current_user),
-                           db: Session = Depends(get_db)):
+                           db: Session = Depends(get_async_db)):
     message = ""
     check_auth = repository_auth()
     current_user = await check_auth.check_authentication(request=request, db=db)
@@ -144,7 +153,7 @@ async def remove_tag_from_photo(request: Request,
                                 photo_id: int,
                                 tag: str,
                                 #    current_user: User = Depends(auth_service.get_current_user),
-                                db: Session = Depends(get_db)):
+                                db: Session = Depends(get_async_db)):
     message = ""
     check_auth = repository_auth()
     current_user = await check_auth.check_authentication(request=request, db=db)
@@ -168,7 +177,7 @@ async def update_photo_description(request: Request,
                                    photo_id: int,
                                    body: PhotoUpdateModel,
                                 #    current_user: User = Depends(auth_service.get_current_user),
-                                   db: Session = Depends(get_db)):
+                                   db: Session = Depends(get_async_db)):
     message = ""
     check_auth = repository_auth()
     current_user = await check_auth.check_authentication(request=request, db=db)
@@ -190,7 +199,7 @@ async def update_photo_description(request: Request,
 async def delete_photo(request: Request,
                        photo_id: int,
                     #    current_user: User = Depends(auth_service.get_current_user),
-                       db: Session = Depends(get_db)):
+                       db: Session = Depends(get_async_db)):
     message = ""
     check_auth = repository_auth()
     current_user = await check_auth.check_authentication(request=request, db=db)
@@ -213,7 +222,7 @@ async def get_photo_transform( request: Request,
                                photo_id: int,
                                transform_id: int=None,
                                # current_user: User = Depends(auth_service.get_current_user),
-                               db: Session = Depends(get_db)):
+                               db: Session = Depends(get_async_db)):
     
     message = ""
     check_auth = repository_auth()
@@ -227,7 +236,7 @@ async def get_photo_transform( request: Request,
 
             return templates.TemplateResponse('photo/photo-trans.html', {"request": request,
                                                                         "title": messages.CONTACTS_APP, 
-                                                                        "user": app.extra["user"],
+                                                                        "user": get_request_user(request),
                                                                         "photo": Jsons.only_photoresponse_to_json(image["photo"]),
                                                                         "transform": Jsons.transformphotoresponse_to_json(transform),
                                                                         "qualifiers": qualifiers})
@@ -249,14 +258,14 @@ async def photo_transform(request: Request,
                           body: PhotoTransformModel, 
                           photo_id: int,
                         #   current_user: User = Depends(auth_service.get_current_user),
-                          db: Session = Depends(get_db)):
+                          db: Session = Depends(get_async_db)):
 
     message = ""
     check_auth = repository_auth()
     current_user = await check_auth.check_authentication(request=request, db=db)
     if current_user:
         try:
-            base_photo = db.query(Photo).filter(Photo.id == photo_id).first()
+            base_photo = (await db_execute(db, select(Photo).where(Photo.id == photo_id))).scalars().first()
 
             if base_photo is None:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.PHOTO_NOT_FOUND)
@@ -288,14 +297,14 @@ async def update_photo_transform(request: Request,
                                  photo_id: int,
                                  transform_id: int,
                                  #   current_user: User = Depends(auth_service.get_current_user),
-                                 db: Session = Depends(get_db)):
+                                 db: Session = Depends(get_async_db)):
 
     message = ""
     check_auth = repository_auth()
     current_user = await check_auth.check_authentication(request=request, db=db)
     if current_user:
         try:
-            base_photo = db.query(Photo).filter(Photo.id == photo_id).first()
+            base_photo = (await db_execute(db, select(Photo).where(Photo.id == photo_id))).scalars().first()
 
             if base_photo is None:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.PHOTO_NOT_FOUND)
@@ -303,7 +312,8 @@ async def update_photo_transform(request: Request,
             if base_photo.user_id != current_user.id:
                 raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=messages.OPERATION_NOT_AVAILABLE)
 
-            photourl = db.query(PhotoURL).filter(and_(PhotoURL.photo_id == photo_id, PhotoURL.id == transform_id)).first()
+            query = select(PhotoURL).where(and_(PhotoURL.photo_id == photo_id, PhotoURL.id == transform_id))
+            photourl = (await db_execute(db, query)).scalars().first()
             if not photourl:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.TRANS_PHOTO_NOT_FOUND)
 
@@ -329,13 +339,13 @@ async def create_qrcode(request: Request,
                         body: PhotoQRCodeModel,
                         photo_id: int,
                         # user: User = Depends(auth_service.get_current_user), 
-                        db: Session = Depends(get_db)):
+                        db: Session = Depends(get_async_db)):
     message = ""
     check_auth = repository_auth()
     current_user = await check_auth.check_authentication(request=request, db=db)
     if current_user:
         try:
-            base_photo = db.query(Photo).filter(Photo.id == photo_id).first()
+            base_photo = (await db_execute(db, select(Photo).where(Photo.id == photo_id))).scalars().first()
 
             if base_photo is None:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.PHOTO_NOT_FOUND)
@@ -366,14 +376,14 @@ async def create_trans_qrcode(request: Request,
                               photo_id: int, 
                               transform_photo_id: int,
                             #   user: User = Depends(auth_service.get_current_user), 
-                              db: Session = Depends(get_db)):
+                              db: Session = Depends(get_async_db)):
 
     message = ""
     check_auth = repository_auth()
     current_user = await check_auth.check_authentication(request=request, db=db)
     if current_user:
         try:
-            base_photo = db.query(Photo).filter(Photo.id == photo_id).first()
+            base_photo = (await db_execute(db, select(Photo).where(Photo.id == photo_id))).scalars().first()
 
             if base_photo is None:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.PHOTO_NOT_FOUND)
@@ -382,8 +392,9 @@ async def create_trans_qrcode(request: Request,
                 raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=messages.OPERATION_NOT_AVAILABLE)
 
             if transform_photo_id:
-                photo = db.query(PhotoURL).filter(and_(PhotoURL.photo_id == photo_id,
-                                                        PhotoURL.id == transform_photo_id)).first()
+                query = select(PhotoURL).where(and_(PhotoURL.photo_id == photo_id,
+                                                    PhotoURL.id == transform_photo_id))
+                photo = (await db_execute(db, query)).scalars().first()
                 if photo is None:
                     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.TRANS_PHOTO_NOT_FOUND)
             else:
@@ -403,20 +414,48 @@ async def create_trans_qrcode(request: Request,
                                       status_code=status.HTTP_302_FOUND)
 
 
+@router.post("/qrcodes",
+             response_model=QRBatchJobResponse,
+             status_code=status.HTTP_202_ACCEPTED,
+             dependencies=[Depends(allowed_operation_all), Depends(RateLimiter(times=2, seconds=60))])
+async def create_qrcodes_batch(body: PhotoQRCodeModel,
+                               user: User = Depends(auth_service.get_current_user),
+                               db: Session = Depends(get_async_db)):
+    """
+    Start generating the missing QR codes of all photos and transforms of the current user.
+    Returns the job, its progress is available at GET /qrcodes/{job_id} of the same worker.
+    While a job of the user is running on this worker, that job is returned instead of a new one.
+    """
+    job = await start_qr_batch(user, body, db)
+    return job.to_dict()
+
+
+@router.get("/qrcodes/{job_id}",
+            response_model=QRBatchJobResponse,
+            dependencies=[Depends(allowed_operation_all)])
+async def get_qrcodes_batch(job_id: str,
+                            user: User = Depends(auth_service.get_current_user)):
+    job = get_qr_batch(job_id, user)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.JOB_NOT_FOUND)
+    return job.to_dict()
+
+
 @router.delete("/{photo_id}/{transform_photo_id}",
                status_code=204,
                description=messages.NO_MORE_THAN_10_REQUESTS_PER_MINUTE,
                dependencies=[Depends(allowed_operation_all), Depends(RateLimiter(times=10, seconds=60))])
 async def delete_transform_photo(photo_id: int,
                                  transform_photo_id: int,
-                                 user: User = Depends(auth_service.get_current_user), db: Session = Depends(get_db)):
+                                 user: User = Depends(auth_service.get_current_user), db: Session = Depends(get_async_db)):
 
-    photo = db.query(PhotoURL).filter(and_(Photo.id == photo_id, PhotoURL.id == transform_photo_id)).first()
+    query = select(PhotoURL).where(and_(PhotoURL.photo_id == photo_id, PhotoURL.id == transform_photo_id))
+    photo = (await db_execute(db, query)).scalars().first()
 
     if photo is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.TRANS_PHOTO_NOT_FOUND)
 
-    base_photo = db.query(Photo).filter(Photo.id == photo.photo_id).first()
+    base_photo = (await db_execute(db, select(Photo).where(Photo.id == photo.photo_id))).scalars().first()
 
     if base_photo is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.PHOTO_NOT_FOUND)
@@ -427,12 +466,21 @@ async def delete_transform_photo(photo_id: int,
     return await PhotosRepository().delete_transform_photo(photo, db)
 
 
+@router.get('/{photo_id}/comments', response_model=CommentPage)
+async def get_comments(photo_id: int,
+                       cursor: str = Query(None, description="next_cursor of the previous page"),
+                       limit: int = Query(settings.comments_page_size, ge=1, le=100, description="Comments per page"),
+                       db: Session = Depends(get_async_db)):
+    comments, next_cursor, total = await repository_comments.get_comments_thread(photo_id, limit, cursor, db)
+    return {"comments": comments, "next_cursor": next_cursor, "total": total}
+
+
 @router.post('/{photo_id}/comments', response_model=CommentResponse, status_code=status.HTTP_201_CREATED)
 async def create_comment(request: Request,
                          photo_id: int,
                          body: CommentModel,
                         #  user: User = Depends(auth_service.get_current_user),
-                         db: Session = Depends(get_db)):
+                         db: Session = Depends(get_async_db)):
     message = ""
     check_auth = repository_auth()
     current_user = await check_auth.check_authentication(request=request, db=db)
@@ -457,7 +505,7 @@ async def update_comment(photo_id: int,
                          comment_id: int,
                          body: CommentModel,
                          user: User = Depends(auth_service.get_current_user),
-                         db: Session = Depends(get_db)):
+                         db: Session = Depends(get_async_db)):
     comment = await repository_comments.update_comment(photo_id, comment_id, body, user, db)
     return comment
 
@@ -468,6 +516,6 @@ async def update_comment(photo_id: int,
 async def delete_comment(photo_id: int,
                          comment_id: int,
                          user: User = Depends(auth_service.get_current_user),
-                         db: Session = Depends(get_db)):
+                         db: Session = Depends(get_async_db)):
     comment = await repository_comments.delete_comment(photo_id, comment_id, user, db)
     return comment
@@ -0,0 +1,29 @@
+from typing import List
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from src.conf.config import settings
+from src.database.db import get_async_db
+from src.schemas import TagSuggestion
+from src.services.tag_index import tag_index
+
+router = APIRouter(prefix="", tags=["tags"])
+
+
+@router.get('/autocomplete', response_model=List[TagSuggestion])
+async def autocomplete_tags(q: str = Query("", max_length=50),
+                            limit: int = Query(settings.tag_autocomplete_limit, ge=1, le=50),
+                            db: Session = Depends(get_async_db)):
+    """
+    The autocomplete_tags function returns the most popular tags starting with the prefix q.
+        The tags are looked up in the in-memory index, the database is queried only to reload the index.
+
+    :param q: str: The prefix of the tag names, case-insensitive (a blank prefix returns no tags)
+    :param limit: int: The maximum number of tags
+    :param db: Session: The database session used to reload the index
+    :return: A list of tags with their number of photos
+    :doc-author: Python-WEB13-project-team-2
+    """
+    tags = await tag_index.search(q, limit, db)
+    return [{"id": tag_id, "name": name, "photo_count": photo_count} for tag_id, name, photo_count in tags]
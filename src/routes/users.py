@@ -4,8 +4,8 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query, Path, Requ
 # from fastapi_limiter.depends import RateLimiter
 from sqlalchemy.orm import Session
 
-from src.base import app, templates
-from src.database.db import get_db
+from src.base import templates, get_request_user
+from src.database.db import get_async_db
 from src.database.models import User, UserRole
 from src.repository import users as repository_users
 from src.repository.auth import Auth as repository_auth
@@ -33,20 +33,21 @@ async def get_users(request: Request,
                     # limit: int = Query(10, le=50), 
                     # offset: int = 0, 
                     search_mask: str = '',
+                    cursor: str = Query(None, description="Cursor of the neighbouring page"),
                     # current_user: User = Depends(auth_service.get_current_user),
-                    db: Session = Depends(get_db)):
+                    db: Session = Depends(get_async_db)):
 
     current_user = await repository_auth().check_authentication(request=request, db=db)
     if current_user:
         if not search_mask or search_mask == '*':
             # print('Get all users')
-            users, pages = await repository_users.get_users(per_page, page, db)
+            users, pages = await repository_users.get_users(per_page, page, db, cursor)
         else:
             # print(f'Search users by mask "{search_mask}"')
-            users, pages = await repository_users.get_users_by_mask(per_page, page, search_mask, db)
+            users, pages = await repository_users.get_users_by_mask(per_page, page, search_mask, db, cursor)
         return templates.TemplateResponse("users/users.html", {"request": request,
                                                                 "title": messages.CONTACTS_APP, 
-                                                                "user": app.extra["user"],
+                                                                "user": get_request_user(request),
                                                                 "roles": UserRole,
                                                                 "users": Jsons.list_useradminresponse_to_json(users),
                                                                 "pages": pages})
@@ -61,7 +62,7 @@ async def get_users(request: Request,
 async def get_user(request: Request,
                    user_id: int = Path(ge=1),
                 #    current_user: User = Depends(auth_service.get_current_user),
-                   db: Session = Depends(get_db)):
+                   db: Session = Depends(get_async_db)):
 
     current_user = await repository_auth().check_authentication(request=request, db=db)
     if current_user:
@@ -70,7 +71,7 @@ async def get_user(request: Request,
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.NOT_FOUND)
         return templates.TemplateResponse("users/user.html", {"request": request,
                                                               "title": messages.CONTACTS_APP, 
-                                                              "user": app.extra["user"],
+                                                              "user": get_request_user(request),
                                                               "roles": UserRole,
                                                               "user1": Jsons.useradminresponse_to_json(user)})
     return responses.RedirectResponse("/",
@@ -84,7 +85,7 @@ async def get_user(request: Request,
 async def toogle_banned_user(request: Request,
                              user_id: int = Path(ge=1),
                             #  current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+                             db: Session = Depends(get_async_db)):
     # print(f">>> toggle_ban user_id: {user_id}")
     current_user = await repository_auth().check_authentication(request=request, db=db)
     if current_user:
@@ -111,7 +112,7 @@ async def set_roles_user(request: Request,
                          user_id: int = Path(ge=1),
                          user_roles: str = 'user',
                         #  current_user: User = Depends(auth_service.get_current_user),
-                         db: Session = Depends(get_db)):
+                         db: Session = Depends(get_async_db)):
     # print(f">>> user_id: {user_id}, new_roles: {user_roles}")
     current_user = await repository_auth().check_authentication(request=request, db=db)
     if current_user:
@@ -6,6 +6,7 @@ import json
 from pydantic import BaseModel, Field, EmailStr, model_validator, constr
 
 from src.database.models import UserRole
+from src.services.qualifiers import qualifier_schema
 
 
 class UserModel(BaseModel):
@@ -82,6 +83,7 @@ class PhotoSchema(BaseModel):
     created_at: datetime
     user_id: int
     username: str
+    comment_count: Optional[int] = 0
 
 
 class PhotoUpdateModel(BaseModel):
@@ -112,6 +114,10 @@ class TagDetail(BaseModel):
     name: str
 
 
+class TagSuggestion(TagDetail):
+    photo_count: int
+
+
 class TagsModel(BaseModel):
     tags: Optional[List[TagDetail]]
 
@@ -145,8 +151,8 @@ class CommentDelete(BaseModel):
 class CommentDB(BaseModel):
     id: int
     text: str
-    user_id: int
-    username: str
+    user_id: Optional[int] = None     # None for comments of deleted users
+    username: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -157,6 +163,12 @@ class CommentResponse(BaseModel):
     detail: Optional[Dict] = {"reload": ""}
 
 
+class CommentPage(BaseModel):
+    comments: List[CommentDB]
+    next_cursor: Optional[str] = None
+    total: int
+
+
 class PhotoURLModel(BaseModel):
     file_url: str
     qr_url: Optional[str]
@@ -190,6 +202,15 @@ class PhotoTransformModel(BaseModel):
             return cls(**json.loads(value))
         return value
 
+    @model_validator(mode='after')
+    def validate_qualifiers(self):
+        # the ranges and values of src/transformation.json, checked before the URL is built
+        for name in ("height", "width", "crop", "gravity", "radius", "fetch_format", "effect", "quality"):
+            value = getattr(self, name)
+            if value:
+                qualifier_schema.validate(name, value)
+        return self
+
 
 class PhotoQRCodeModel(BaseModel):
     fill_color: str | None = "black"
@@ -220,6 +241,15 @@ class PhotoExtResponse(BaseModel):
 # class ErrorsResponse(BaseModel):
 #     errors:  Optional[List[Dict]]
 
+class QRBatchJobResponse(BaseModel):
+    id: str
+    status: str
+    total: int
+    done: int
+    failed: int
+    errors: List[str] = []
+
+
 class DetailResponse(BaseModel):
     detail: Optional[Dict] = {"success": [{"key": "string", "value": "string"}], "errors": [{"key": "string", "value": "string"}]}
 
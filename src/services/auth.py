@@ -3,19 +3,24 @@ from typing import Optional
 # import pickle
 
 from jose import JWTError, jwt
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 # import redis
 
-from src.base import app
-from src.database.db import get_db
+from src.base import set_request_user
+from src.database.db import get_async_db
 from src.repository import users as repository_users
 from src.conf.config import settings
 from src.conf import messages
 from src.services.utils import OAuth2PasswordBearerWithCookie
+from src.services.user_cache import remember_user, recall_user
+
+# Requests which may be authenticated with the cached user (see src/services/user_cache.py)
+CACHED_USER_METHODS = ("GET", "HEAD", "OPTIONS")
+
 
 class Auth:
     pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -117,20 +122,51 @@ class Auth:
             print(err)
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=messages.COULD_NOT_VALIDATE_CREDENTIALS)
 
+    def get_email_from_expired_token(self, token: str) -> str | None:
+        """
+        The get_email_from_expired_token function returns the email of the access token even if it has expired,
+            so the user of the failed authentication can be signed out. The signature is still verified.
+        
+        :param self: Represent the instance of the class
+        :param token: str: The access token
+        :return: The email of the user or None if the token is not a valid access token
+        :doc-author: Python-WEB13-project-team-2
+        """
+        try:
+            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM], options={"verify_exp": False})
+        except JWTError:
+            return None
+        if payload.get('scope') == 'access_token':
+            return payload.get('sub')
+        return None
+
+    @staticmethod
+    def _reset_request_user(request: Request | None):
+        if request is not None:
+            set_request_user(request, {"is_authenticated": False})
+
     # async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def get_current_user(self, request: Request = None, token: str = Depends(oauth2_scheme),
+                               db: Session = Depends(get_async_db)):
         """
         The get_current_user function is a dependency that will be used in the UserController class.
             It takes in a token and db session as parameters, and returns the user object associated with
             the email address stored within the JWT token. If no user exists for that email address, or if 
             the JWT token is invalid, an HTTPException will be raised.
+            The user is resolved once per request (kept in request.state for the other dependencies)
+            and its columns are cached for settings.auth_cache_ttl seconds per token, so hot paths do not query the database.
         
         :param self: Represent the instance of a class
+        :param request: Request: The current request, used to reuse the user resolved by another dependency
         :param token: str: Get the token from the request header
         :param db: Session: Get the database session
         :return: A user object
         :doc-author: Python-WEB13-project-team-2
         """
+        resolved = getattr(request.state, "current_user", None) if request is not None else None
+        if resolved is not None and resolved[0] == token:
+            return resolved[1]
+
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=messages.COULD_NOT_VALIDATE_CREDENTIALS,
@@ -146,27 +182,38 @@ class Auth:
                 # print(f">>> get_current_user: email={email}")
                 if email is None:
                     # print(">>> get_current_user: email is None")
-                    app.extra["user"].update({"is_authenticated": False})
+                    self._reset_request_user(request)
                     raise credentials_exception
             else:
                 # print(">>> get_current_user: payload['scope'] != 'access_token'")
-                app.extra["user"].update({"is_authenticated": False})
+                self._reset_request_user(request)
                 raise credentials_exception
         except JWTError as e:
             # print(f">>> get_current_user: except JWTError \"{e}\"")
-            app.extra["user"].update({"is_authenticated": False})
+            self._reset_request_user(request)
             raise credentials_exception
 
         try:
-            user = await repository_users.get_user_by_email(email, db)
+            # the cache is per worker, a ban or a role change made on another worker is seen by it only
+            # after settings.auth_cache_ttl, so requests which change data always load the user from the database
+            user = None
+            if request is None or request.method in CACHED_USER_METHODS:
+                user = await recall_user(email, payload.get("iat"), db)
+            if user is None:
+                user = await repository_users.get_user_by_email(email, db)
+                if user is not None:
+                    remember_user(user, payload.get("iat"))
         except SQLAlchemyError as err:
-            app.extra["user"].update({"is_authenticated": False})
+            self._reset_request_user(request)
             raise credentials_exception
 
         if user is None:
             # print(">>> get_current_user: user is None")
-            app.extra["user"].update({"is_authenticated": False})
+            self._reset_request_user(request)
             raise credentials_exception
+
+        if request is not None:
+            request.state.current_user = (token, user)
         return user
 
 
@@ -1,3 +1,4 @@
+import logging
 import re
 
 import cloudinary
@@ -5,6 +6,9 @@ import cloudinary.uploader
 
 from src.conf.config import settings
 from src.database.models import User
+from src.services.qualifiers import qualifier_schema
+
+logger = logging.getLogger(__name__)
 
 
 class CloudImage:
@@ -30,20 +34,29 @@ class CloudImage:
         """
         if not folder:
             folder = user.username
-        res = cloudinary.uploader.upload(photo_file, folder=folder)
+        res = cloudinary.uploader.upload(photo_file, folder=folder, timeout=settings.storage_timeout)
         return res["secure_url"]
 
 
+    @staticmethod
+    def get_public_id(image_url: str) -> str | None:
+        """
+        The public id of a Cloudinary URL: the path after the version without the extension,
+            e.g. "user/photo" for ".../image/upload/v1695/user/photo.jpg".
+        """
+        match = re.search(r"/v\d+/(.+?)(\.\w+)?$", image_url)
+        return match.group(1) if match else None
+
+    @staticmethod
+    def get_folder(image_url: str) -> str | None:
+        public_id = CloudImage.get_public_id(image_url)
+        return public_id.rpartition("/")[0] if public_id else None
+
     @staticmethod
     def delete_image(image_url: str):
-        pattern = r"/v\d+/(.*?)\."
-        match = re.search(pattern, image_url)
-        if not match:
-            pattern = r"/v\d+/(.*?)$"
-            match = re.search(pattern, image_url)
-        if match:
-            public_id = match.group(1)
-            result = cloudinary.uploader.destroy(public_id)
+        public_id = CloudImage.get_public_id(image_url)
+        if public_id:
+            result = cloudinary.uploader.destroy(public_id, timeout=settings.storage_timeout)
             if result.get('result') == 'ok':
                 return ""
             else:
@@ -53,49 +66,47 @@ class CloudImage:
 
 
     @staticmethod
-    def upload_transform_image(body, photo_file_url) -> str:
-
-        def prepare_property(value):
-            prls = value.split('||')
-            return prls[len(prls)-1]
-        
-        public_id = re.search(r"/v\d+/(.+)\.\w+$", photo_file_url).group(1)
+    def get_transform_params(body) -> list:
+        """
+        The list of Cloudinary transformations of the PhotoTransformModel.
+        Values not allowed by the compiled qualifiers raise QualifierError.
+        """
         trans_params = []
-        
+
         trans = {}
-        if body.height:
-            trans.update({'height': prepare_property(body.height)})
-        if body.width:
-            trans.update({'width': prepare_property(body.width)})
-        if body.crop:
-            trans.update({'crop': prepare_property(body.crop)})
-        if body.gravity:
-            trans.update({'gravity': prepare_property(body.gravity)})
+        for name in ("height", "width", "crop", "gravity"):
+            value = getattr(body, name)
+            if value:
+                trans.update({name: qualifier_schema.validate(name, value)})
         if trans:
             trans_params.append(trans)
 
-        if body.radius:
-            trans_params.append({'radius': prepare_property(body.radius)})
-        if body.effect:
-            trans_params.append({'effect': prepare_property(body.effect)})
-        if body.quality:
-            trans_params.append({'quality': prepare_property(body.quality)})
-        if body.fetch_format:
-            trans_params.append({'fetch_format': prepare_property(body.fetch_format)})
-        print(f'>>> trans_params = {trans_params}')
+        for name in ("radius", "effect", "quality", "fetch_format"):
+            value = getattr(body, name)
+            if value:
+                trans_params.append({name: qualifier_schema.validate(name, value)})
+        return trans_params
+
+
+    @staticmethod
+    def upload_transform_image(body, photo_file_url) -> str:
+        public_id = CloudImage.get_public_id(photo_file_url)
+        trans_params = CloudImage.get_transform_params(body)
+        logger.debug("Transformation of %s: %s", public_id, trans_params)
 
         url_changed_photo = cloudinary.CloudinaryImage(f"{public_id}").build_url(transformation=trans_params)
         return url_changed_photo
 
 
     @staticmethod
-    def upload_qrcode(qr_os_path, qr_ci_folder, qr_name) -> str:
+    def upload_qrcode(qr_file, qr_ci_folder, qr_name) -> str:
 
         result = cloudinary.uploader.upload(
-            qr_os_path,
+            qr_file,
             folder=qr_ci_folder,
             resource_type="image",
-            public_id=f"{qr_name}"
+            public_id=f"{qr_name}",
+            timeout=settings.storage_timeout
         )
 
         return result['url']
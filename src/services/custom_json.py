@@ -1,13 +1,11 @@
-import os
-import json
 from typing import List, Dict
 from datetime import datetime, timezone
 
-from src.base import app
 # from src.database.models import User
 from src.schemas import (UserDbResponse, UserDbAdmin, UserRole, 
                          PhotoResponse, CommentResponse, TagDetail, PhotoSchema, 
                          PhotoURLResponse, PhotoTransformModel)
+from src.services.qualifiers import qualifier_schema
 
 
 class Jsons:
@@ -80,6 +78,10 @@ class Jsons:
             res_photo.update({"username": photo.username})
         except:
             pass
+        try:
+            res_photo.update({"comment_count": photo.comment_count})
+        except:
+            pass
 
         return res_photo
 
@@ -154,21 +156,8 @@ class Jsons:
 
     @staticmethod
     async def get_qualifiers():
-        file = 'src/transformation.json'
-        qualifiers = app.extra["qualifiers"]
-        ts = app.extra["qualifiers_ts"]
-        modified = os.path.getmtime(file)
-
-        if not qualifiers or not ts or ts < modified:
-            with open(file, 'r') as fh:
-            # with open('src/transform.json', 'r') as fh:
-                res = json.load(fh)
-
-            qualifiers = res["qualifiers"]
-            app.extra.update({"qualifiers": qualifiers})
-            app.extra.update({"qualifiers_ts": modified})
-
-        return qualifiers
+        # src/transformation.json is loaded once at startup together with its compiled schema
+        return qualifier_schema.raw
 
 
     @staticmethod
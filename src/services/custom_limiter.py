@@ -1,45 +1,160 @@
 import time
+import logging
+import threading
+from collections import OrderedDict
 
 from fastapi import Request, HTTPException
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
 
-# In-memory storage for request counters
-request_counters = {}
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowCounter:
+    """
+    In-memory sliding window rate limiter with O(1) checks and bounded memory.
+
+    Every key keeps the number of requests of the current and the previous fixed window.
+    The rate over the last `seconds` is estimated as the current count plus the part of
+    the previous count which still overlaps the sliding window. Keys are kept in the order
+    of use: a few expired keys are dropped from the head on every check and the least
+    recently used key is evicted when `maxsize` is reached, so no full scans are needed.
+    """
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._counters = OrderedDict()   # key: [window start, current count, previous count, expires]
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, times: int, seconds: int, now: float = None) -> bool:
+        """
+        Count a request of `key` and return False if it exceeds `times` requests per `seconds`.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._evict(now)
+            counter = self._counters.get(key)
+            window = now - now % seconds
+            if counter is None:
+                counter = [window, 0, 0, 0]
+            elif counter[0] != window:
+                # the previous window is only relevant if it is the one right before this one
+                previous = counter[1] if window - counter[0] == seconds else 0
+                counter[:3] = [window, 0, previous]
+
+            overlap = 1 - (now - window) / seconds
+            if counter[1] + counter[2] * overlap >= times:
+                allowed = False
+            else:
+                counter[1] += 1
+                allowed = True
+
+            counter[3] = window + 2 * seconds
+            self._counters[key] = counter
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.maxsize:
+                self._counters.popitem(last=False)
+        return allowed
+
+    def _evict(self, now: float, count: int = 2) -> None:
+        for _ in range(count):
+            if not self._counters:
+                return
+            key, counter = next(iter(self._counters.items()))
+            if counter[3] > now:
+                return
+            del self._counters[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+
+class MemoryBackend:
+    """
+    Rate limit counters of this process. Limits are not shared between workers,
+    so it is meant for a single worker, development and tests.
+    """
+    def __init__(self, maxsize: int = 100000):
+        self.counters = SlidingWindowCounter(maxsize=maxsize)
+
+    async def hit(self, key: str, times: int, seconds: int) -> bool:
+        return self.counters.hit(key, times, seconds)
+
+
+class RedisBackend:
+    """
+    Rate limit counters in Redis, shared by all workers and kept over restarts.
+
+    Uses the same sliding window estimate as SlidingWindowCounter: the counts of the current
+    and the previous window are separate keys, and the check and the increment run atomically
+    in a Lua script. If Redis is not available the request is allowed.
+    """
+    SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if current + previous * tonumber(ARGV[2]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+    def __init__(self, client: aioredis.Redis, prefix: str = "rate_limit"):
+        self.client = client
+        self.prefix = prefix
+        self.script = client.register_script(self.SCRIPT)
+
+    async def hit(self, key: str, times: int, seconds: int) -> bool:
+        now = time.time()
+        window = int(now // seconds)
+        overlap = 1 - (now % seconds) / seconds
+        keys = [f"{self.prefix}:{key}:{seconds}:{window}", f"{self.prefix}:{key}:{seconds}:{window - 1}"]
+        try:
+            return bool(await self.script(keys=keys, args=[times, overlap, 2 * seconds]))
+        except RedisError as err:
+            logger.warning("Rate limiter: Redis is not available (%s), request is allowed", err)
+            return True
+
+
+def get_backend():
+    """
+    The rate limit backend of settings.rate_limit_backend: 'memory' or 'redis'.
+    """
+    if settings.rate_limit_backend == "redis":
+        client = aioredis.Redis(host=settings.redis_host, port=settings.redis_port,
+                                password=settings.redis_password, db=settings.rate_limit_redis_db)
+        return RedisBackend(client)
+    if settings.rate_limit_backend != "memory":
+        raise ValueError(f"Unknown rate limit backend: {settings.rate_limit_backend}")
+    return MemoryBackend(maxsize=settings.rate_limit_max_keys)
+
+
+# Storage for request counters
+request_counters = get_backend()
 
 # Custom RateLimiter class with dynamic rate limiting values per route
 class RateLimiter:
-    def __init__(self, times: int, seconds: int):
+    def __init__(self, times: int, seconds: int, backend: MemoryBackend | RedisBackend = None):
         self.requests_limit = times
         self.time_window = seconds
+        self.backend = backend
 
     async def __call__(self, request: Request):
         client_ip = request.client.host
         route_path = request.url.path
 
-        # Get the current timestamp
-        current_time = int(time.time())
-
         # Create a unique key based on client IP and route path
         key = f"{client_ip}:{route_path}"
 
-        # Check if client's request counter exists
-        if key not in request_counters:
-            request_counters[key] = {"timestamp": current_time, "count": 0}
-        else:
-            # Check if the time window has elapsed, reset the counter if needed
-            if current_time - request_counters[key]["timestamp"] > self.time_window:
-                # Reset the counter and update the timestamp
-                request_counters[key]["timestamp"] = current_time
-                request_counters[key]["count"] = 0
-            else:
-                # Check if the client has exceeded the request limit
-                if request_counters[key]["count"] >= self.requests_limit:
-                    raise HTTPException(status_code=429, detail="Too Many Requests")
-                else:
-                    request_counters[key]["count"] += 1
-
-        # Clean up expired client data (optional)
-        for k in list(request_counters.keys()):
-            if current_time - request_counters[k]["timestamp"] > self.time_window:
-                request_counters.pop(k)
+        backend = self.backend or request_counters
+        if not await backend.hit(key, self.requests_limit, self.time_window):
+            raise HTTPException(status_code=429, detail="Too Many Requests",
+                                headers={"Retry-After": str(self.time_window)})
 
         return True
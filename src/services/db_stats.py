@@ -0,0 +1,53 @@
+import time
+import typing as t
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from src.conf.config import settings
+
+
+class QueryStats:
+    """
+    The number of SQL statements executed while handling a request and their cumulative time.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    @property
+    def duration_ms(self) -> float:
+        return round(self.duration * 1000, 2)
+
+
+# Stats of the current request; the object is shared with the tasks and greenlets started by the request
+query_stats: ContextVar[t.Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def start_request() -> QueryStats:
+    """
+    Start collecting the SQL statistics of the current request.
+    """
+    stats = QueryStats()
+    query_stats.set(stats)
+    return stats
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and query_stats.get() is not None:
+        context.query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = query_stats.get()
+    start = getattr(context, "query_start", None)
+    if stats is None or start is None:
+        return
+    stats.count += 1
+    stats.duration += time.perf_counter() - start
+
+
+if settings.db_instrumentation:
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -1,11 +1,41 @@
 import typing as t
 import math
+import json
+import base64
+import binascii
+from datetime import datetime
 
 import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session, lazyload, Query
+from sqlalchemy.sql.util import find_tables
+from fastapi import HTTPException, status
+
+from src.conf import messages
+from src.conf.config import settings
+from src.database.db import db_execute
+from src.services.cache import TTLCache
 
 VISIBLE_PAGE_COUNT = 9
 
+# Row counts of paginated queries keyed by (SQL, params, versions of the tables it reads)
+count_cache = TTLCache(maxsize=settings.count_cache_size, ttl=settings.count_cache_ttl)
+table_versions: t.Dict[str, int] = {}
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _invalidate_counts(conn, cursor, statement, parameters, context, executemany):
+    """
+    Bump the version of a table on INSERT/DELETE, so cached counts that read it are not used anymore.
+    """
+    if context is None or not (context.isinsert or context.isdelete):
+        return
+    table = getattr(getattr(context.compiled, "statement", None), "table", None)
+    name = getattr(table, "name", None)
+    if name:
+        table_versions[name] = table_versions.get(name, 0) + 1
+
 
 class Pager:
     def __init__(self, page: int=1, per_page: int=10, row_count: int=10):
@@ -94,17 +124,61 @@ class Pager:
 
     def prepare_full_range(self):
         self.extend_by_range(1, self.last_page + 1)
-        self.pages[self.page - 1]['class'] = 'active'
+        if self.page <= len(self.pages):
+            self.pages[self.page - 1]['class'] = 'active'
+
+
+class Cursor:
+    """
+    Opaque keyset cursor: the values of the key columns of a boundary row and the direction.
+    """
+    NEXT = "n"
+    PREV = "p"
+
+    @staticmethod
+    def encode(values: t.List[t.Any], direction: str) -> str:
+        values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+        data = json.dumps({"k": values, "d": direction}, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+    @staticmethod
+    def decode(cursor: str, keys: t.List[sa.ColumnElement]) -> t.Tuple[t.List[t.Any], str]:
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            values, direction = data["k"], data["d"]
+            if len(values) != len(keys) or direction not in (Cursor.NEXT, Cursor.PREV):
+                raise ValueError(cursor)
+            values = [datetime.fromisoformat(v) if isinstance(key.type, sa.DateTime) and v is not None else v
+                      for key, v in zip(keys, values)]
+        except (ValueError, TypeError, KeyError, binascii.Error):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.INVALID_CURSOR)
+        return values, direction
 
 
 class Pagination:
-    def __init__(self, select: sa.sql.Select[t.Any], session: Session, page: int, per_page: int):
+    """
+    Paginate a select by LIMIT/OFFSET or, when `keys` are given, by keyset.
+
+    In keyset mode the rows are ordered by `keys` (e.g. (Photo.created_at, Photo.id)) and every page
+    returns opaque `next_cursor`/`prev_cursor`. Passing one of them back as `cursor` fetches the
+    neighbouring page with a `(keys) < (values)` condition instead of skipping rows, so deep pages
+    cost the same as the first one. Page numbers of the navigation still jump by offset.
+    """
+    def __init__(self, select: sa.sql.Select[t.Any], session: Session, page: int, per_page: int,
+                 keys: t.List[sa.ColumnElement] = None, descending: bool = True, cursor: str = None,
+                 estimate: bool = False):
         self.select = select
         self.session = session
-        count = self._query_count()
-        self.pager = Pager(page, per_page, count)
+        self.keys = list(keys) if keys else []
+        self.descending = descending
+        self.cursor = cursor if self.keys else None
+        self.estimate = estimate
+        self.page = page
+        self.per_page = per_page
 
-    def get_page(self):
+    async def get_page(self):
+        count = await self._query_count()
+        self.pager = Pager(self.page, self.per_page, count)
         pg = self.pager.get_pages()
         self.skip = (self.pager.page - 1) * self.pager.page_size
         first_row = self.skip + 1
@@ -115,20 +189,99 @@ class Pagination:
                   "last_row": last_row,
                   "total_rows": self.pager.count}]
         pages.extend(pg)
-        items = self._query_items()
+        if self.keys:
+            items, prev_cursor, next_cursor = await self._query_keyset_items()
+            pages[0].update({"prev_cursor": prev_cursor, "next_cursor": next_cursor})
+            pg[0].update({"cursor": prev_cursor})
+            pg[-1].update({"cursor": next_cursor})
+        else:
+            items = await self._query_items()
         # print(f"items.count = {len(items)}, page = {self.pager.page}, per_page = {self.pager.page_size}, pages = {self.pager.last_page}, total_rows = {self.pager.count}")
         # print(pages)
         # print(items)
         return items, pages
 
-    def _query_items(self):
+    async def _query_items(self):
         select = self.select.limit(self.pager.page_size).offset(self.skip)
         # res = list(self.session.execute(select).scalars())
-        res = list(self.session.execute(select).all())
+        res = list((await db_execute(self.session, select)).all())
         return res
 
-    def _query_count(self) -> int:
-        sub = self.select.options(lazyload("*")).order_by(None).subquery()
-        out = self.session.execute(sa.select(sa.func.count()).select_from(sub)).scalar()
+    def _order_by(self, descending: bool):
+        return [key.desc() if descending else key.asc() for key in self.keys]
+
+    def _row_cursor(self, row, direction: str) -> str:
+        return Cursor.encode([row._mapping[key] for key in self.keys], direction)
+
+    async def _query_keyset_items(self):
+        select = self.select.order_by(None)
+        if not self.cursor:
+            select = select.order_by(*self._order_by(self.descending))
+            res = list((await db_execute(self.session, select.limit(self.pager.page_size).offset(self.skip))).all())
+            has_prev = self.pager.page > 1
+            has_next = self.pager.page < self.pager.last_page
+        else:
+            values, direction = Cursor.decode(self.cursor, self.keys)
+            backward = direction == Cursor.PREV
+            # Moving backward walks the index in the opposite order and reverses the rows afterwards
+            descending = self.descending != backward
+            row_keys, row_values = sa.tuple_(*self.keys), sa.tuple_(*values)
+            select = select.where(row_keys < row_values if descending else row_keys > row_values) \
+                           .order_by(*self._order_by(descending)) \
+                           .limit(self.pager.page_size + 1)
+            res = list((await db_execute(self.session, select)).all())
+            has_more = len(res) > self.pager.page_size
+            res = res[:self.pager.page_size]
+            if backward:
+                res.reverse()
+                has_prev, has_next = has_more, True
+            else:
+                has_prev, has_next = True, has_more
+
+        prev_cursor = self._row_cursor(res[0], Cursor.PREV) if res and has_prev else None
+        next_cursor = self._row_cursor(res[-1], Cursor.NEXT) if res and has_next else None
+        return res, prev_cursor, next_cursor
+
+    async def _query_count(self) -> int:
+        """
+        Row count of the select: a planner estimate for large unfiltered listings (estimate=True),
+        otherwise an exact count(*) cached per query signature until TTL or INSERT/DELETE on its tables.
+        """
+        select = self.select.options(lazyload("*")).order_by(None)
+        if self.estimate:
+            out = await self._query_estimate(select)
+            if out is not None:
+                return out
+
+        key = None
+        if count_cache.ttl > 0:
+            compiled = select.compile(dialect=self.session.get_bind().dialect)
+            tables = sorted({table.name for table in find_tables(select)})
+            key = (str(compiled),
+                   tuple(sorted((k, repr(v)) for k, v in compiled.params.items())),
+                   tuple((name, table_versions.get(name, 0)) for name in tables))
+            out = count_cache.get(key)
+            if out is not None:
+                return out
+
+        sub = select.subquery()
+        out = (await db_execute(self.session, sa.select(sa.func.count()).select_from(sub))).scalar()
+        if key is not None:
+            count_cache.set(key, out)
         return out  # type: ignore[no-any-return]
 
+    async def _query_estimate(self, select: sa.sql.Select[t.Any]) -> int | None:
+        """
+        Row count of an unfiltered single-table select from Postgres planner statistics (pg_class.reltuples).
+        Returns None when the estimate can not be used: other dialects, filters/joins or a small table.
+        """
+        if self.session.get_bind().dialect.name != "postgresql" or select.whereclause is not None:
+            return None
+        froms = select.get_final_froms()
+        if len(froms) != 1 or not isinstance(froms[0], sa.Table):
+            return None
+        query = sa.text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)")
+        out = (await db_execute(self.session, query, {"name": froms[0].name})).scalar()
+        if out is None or out < settings.count_estimate_min_rows:
+            return None
+        return int(out)
@@ -0,0 +1,154 @@
+import asyncio
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Set
+
+from sqlalchemy import select, update
+
+from src.conf.config import settings
+from src.database.db import AsyncDBSession, db_execute, db_commit, db_rollback
+from src.database.models import Photo, PhotoURL, User
+from src.repository.photos import PhotosRepository
+from src.schemas import PhotoQRCodeModel
+from src.services.cache import TTLCache
+from src.services.qr_code import render_qrcode, render_qrcode_async
+
+
+class QRBatchJob:
+    """
+    Progress of the QR code generation for all photos and transforms of a user.
+    """
+    def __init__(self, user_id: int, total: int):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.status = "running" if total else "done"
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.errors: List[str] = []
+
+    def get_status(self) -> str:
+        """
+        The status of a finished job: "done", "partial" (some items failed) or "failed" (all items failed).
+        """
+        if not self.failed:
+            return "done"
+        return "partial" if self.done else "failed"
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "status": self.status, "total": self.total,
+                "done": self.done, "failed": self.failed, "errors": self.errors}
+
+
+# Jobs of this process by id: running jobs are kept until they finish,
+# finished jobs are dropped after settings.qr_batch_job_ttl seconds.
+# The state is not shared between workers, the progress of a job is available only on the worker which started it
+# (with several workers the clients need sticky sessions), and only one running job per user is detected per worker.
+running_jobs: Dict[str, QRBatchJob] = {}
+finished_jobs = TTLCache(maxsize=1024, ttl=settings.qr_batch_job_ttl)
+running_tasks: Set[asyncio.Task] = set()
+process_pool: ProcessPoolExecutor | None = None
+
+
+def start_process_pool() -> None:
+    """
+    Start the processes rendering QR codes of batch jobs, called at the startup of the app.
+    """
+    global process_pool
+    if process_pool is None:
+        process_pool = ProcessPoolExecutor(max_workers=settings.qr_batch_processes)
+
+
+def shutdown_process_pool() -> None:
+    global process_pool
+    if process_pool is not None:
+        process_pool.shutdown(cancel_futures=True)
+        process_pool = None
+
+
+async def render_in_process(data: str, fill_color: str, back_color: str) -> bytes:
+    if process_pool is None:
+        # the app was not started (e.g. a script), render in a thread
+        return await render_qrcode_async(data, fill_color, back_color)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(process_pool, render_qrcode, data, fill_color, back_color)
+
+
+async def start_qr_batch(user: User, body: PhotoQRCodeModel, db) -> QRBatchJob:
+    """
+    Start generating the missing QR codes of all photos and transforms of the user in the background.
+
+    Args:
+        user (User): The owner of the photos.
+        body (PhotoQRCodeModel): The colors of the QR codes.
+        db: The database session of the request.
+
+    Returns:
+        QRBatchJob: The job, its progress is available by the id until the job expires.
+        A job of the user which is still running is returned instead of starting a new one.
+    """
+    running = next((job for job in running_jobs.values() if job.user_id == user.id), None)
+    if running is not None:
+        return running
+
+    query = select(Photo.id).where(Photo.user_id == user.id, Photo.qr_url.is_(None)).order_by(Photo.id)
+    photo_ids = (await db_execute(db, query)).scalars().all()
+    query = select(PhotoURL.id) \
+        .join(Photo, Photo.id == PhotoURL.photo_id) \
+        .where(Photo.user_id == user.id, PhotoURL.qr_url.is_(None)) \
+        .order_by(PhotoURL.id)
+    transform_ids = (await db_execute(db, query)).scalars().all()
+
+    items = [(Photo, id_) for id_ in photo_ids] + [(PhotoURL, id_) for id_ in transform_ids]
+    job = QRBatchJob(user.id, len(items))
+    if not items:
+        finished_jobs.set(job.id, job)
+        return job
+
+    running_jobs[job.id] = job
+    task = asyncio.create_task(_run_qr_batch(job, items, body))
+    running_tasks.add(task)
+    task.add_done_callback(running_tasks.discard)
+    return job
+
+
+async def _run_qr_batch(job: QRBatchJob, items: list, body: PhotoQRCodeModel) -> None:
+    semaphore = asyncio.Semaphore(settings.qr_batch_concurrency)
+
+    async def generate(model, item_id: int):
+        async with semaphore:
+            try:
+                async with AsyncDBSession() as db:
+                    item = (await db_execute(db, select(model).where(model.id == item_id))).scalars().first()
+                    if item is not None and not item.qr_url:
+                        qr_url = await PhotosRepository().update_qr_url(body, item, db, render=render_in_process)
+                        # the reference is kept only if no other request has set the QR code of the item meanwhile,
+                        # otherwise the rollback drops it
+                        query = update(model).where(model.id == item_id, model.qr_url.is_(None)) \
+                            .values(qr_url=qr_url).returning(model.id)
+                        if (await db_execute(db, query)).scalar_one_or_none() is None:
+                            await db_rollback(db)
+                        else:
+                            await db_commit(db)
+                job.done += 1
+            except Exception as err:
+                job.failed += 1
+                job.errors.append(f"{model.__tablename__} {item_id}: {err}")
+
+    try:
+        await asyncio.gather(*(generate(model, item_id) for model, item_id in items))
+    finally:
+        job.status = job.get_status()
+        finished_jobs.set(job.id, job)
+        running_jobs.pop(job.id, None)
+
+
+def get_qr_batch(job_id: str, user: User) -> QRBatchJob | None:
+    """
+    The job of the user by id, or None if there is no such job in this process
+    (jobs started by other workers are not visible here).
+    """
+    job = running_jobs.get(job_id) or finished_jobs.get(job_id)
+    if job is None or job.user_id != user.id:
+        return None
+    return job
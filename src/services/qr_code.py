@@ -0,0 +1,26 @@
+import asyncio
+import io
+
+import qrcode
+
+
+def render_qrcode(data: str, fill_color: str = "black", back_color: str = "white") -> bytes:
+    """
+    Render the QR code of the data into PNG bytes in memory.
+    A plain function, so it can also run in a thread or a process pool.
+    """
+    qr = qrcode.QRCode()
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color=fill_color, back_color=back_color)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def render_qrcode_async(data: str, fill_color: str = "black", back_color: str = "white") -> bytes:
+    """
+    Render the QR code in a worker thread, so the CPU-bound rendering does not block the event loop.
+    """
+    return await asyncio.to_thread(render_qrcode, data, fill_color, back_color)
@@ -0,0 +1,159 @@
+import json
+import pathlib
+import re
+
+QUALIFIERS_FILE = pathlib.Path(__file__).parent.parent / "transformation.json"
+
+HEX_COLOR = re.compile(r"#?[0-9a-fA-F]{3,8}")
+
+
+class QualifierError(ValueError):
+    """
+    The value of a transformation qualifier is not allowed by src/transformation.json.
+    """
+
+
+class Param:
+    """
+    One parameter of a qualifier command: an int or float range, a list of values, a color or any text.
+    """
+    def __init__(self, detail: dict):
+        self.required = detail.get("required") == "true"
+        self.kind, self.minimum, self.maximum, self.default, self.choices = "any", None, None, None, None
+        for kind in ("int", "float"):
+            spec = detail.get(f"range_{kind}")
+            if spec:
+                self.kind = kind
+                cast = int if kind == "int" else float
+                self.minimum, self.maximum = cast(spec["min"]), cast(spec["max"])
+                self.default = cast(spec["default"]) if "default" in spec else None
+        if "range_color" in detail:
+            self.kind = "color"
+        if "list_value" in detail:
+            self.kind = "list"
+            self.choices = frozenset(item["value"] for item in detail["list_value"])
+
+    def accepts(self, token: str) -> bool:
+        if self.kind == "int":
+            try:
+                return self.minimum <= int(token) <= self.maximum
+            except ValueError:
+                return False
+        if self.kind == "float":
+            # decimal values only, an integer is a size in pixels
+            try:
+                return "." in token and self.minimum <= float(token) <= self.maximum
+            except ValueError:
+                return False
+        if self.kind == "color":
+            return bool(HEX_COLOR.fullmatch(token))
+        if self.kind == "list":
+            return token in self.choices
+        return True
+
+
+class Command:
+    """
+    A command of a qualifier with its parameters, e.g. "sepia" with the level or "<px>" with the pixel size.
+    """
+    def __init__(self, command: dict):
+        value = command.get("value") or command["command"]
+        self.is_template = value.startswith("<")
+        self.name = value
+        self.params = [Param(detail) for detail in command.get("details") or []]
+        self.default = next((param.default for param in self.params if param.default is not None), None)
+
+    def accepts_params(self, tokens: list) -> bool:
+        """
+        Parameters after a named command ("sepia:50") are optional and each of them must fit one of its parameters.
+        """
+        tokens = list(tokens)
+        colors = any(param.kind == "color" for param in self.params)
+        if colors and "rgb" in tokens:
+            tokens.remove("rgb")
+        if len(tokens) > len(self.params):
+            return False
+        return all(any(param.accepts(token) for param in self.params) for token in tokens)
+
+    def accepts_value(self, tokens: list) -> bool:
+        """
+        A template command ("<px>", "<pixel_value>") takes its parameters in order, the required ones must be set.
+        """
+        if not tokens or len(tokens) > len(self.params):
+            return False
+        for index, param in enumerate(self.params):
+            if index >= len(tokens):
+                if param.required:
+                    return False
+            elif not param.accepts(tokens[index]):
+                return False
+        return True
+
+
+class Qualifier:
+    def __init__(self, name: str, qualifier: dict):
+        self.name = name
+        self.prefix = qualifier["prefix"]
+        self.commands = {}
+        self.templates = []
+        for command in qualifier["commands"]:
+            compiled = Command(command)
+            if compiled.is_template:
+                self.templates.append(compiled)
+            else:
+                self.commands.setdefault(compiled.name, compiled)
+
+    def find_command(self, value: str) -> tuple:
+        """
+        The named command of the value and the tokens of its parameters, or (None, all tokens).
+        """
+        tokens = value.split(":")
+        # names of some commands contain ":" (face:center), the longest name wins
+        for index in range(len(tokens), 0, -1):
+            command = self.commands.get(":".join(tokens[:index]))
+            if command is not None:
+                return command, tokens[index:]
+        return None, tokens
+
+    def validate(self, value: str) -> str:
+        """
+        Returns the value if it is allowed, raises QualifierError otherwise.
+        """
+        command, tokens = self.find_command(value)
+        if command is not None:
+            if command.accepts_params(tokens):
+                return value
+        elif any(template.accepts_value(tokens) for template in self.templates):
+            return value
+        raise QualifierError(f"Invalid {self.name}: {value}")
+
+
+class QualifierSchema:
+    """
+    The qualifiers of src/transformation.json compiled once for the validation of transformations:
+    the commands of every qualifier by name, their parameter ranges, allowed values and defaults.
+    """
+    def __init__(self, path: pathlib.Path = QUALIFIERS_FILE):
+        with open(path, "r") as fh:
+            self.raw = json.load(fh)["qualifiers"]
+        self.qualifiers = {name: Qualifier(name, qualifier) for name, qualifier in self.raw.items()}
+        self.prefixes = {qualifier.prefix: name for name, qualifier in self.qualifiers.items()}
+
+    def __getitem__(self, name: str) -> Qualifier:
+        return self.qualifiers[name]
+
+    def validate(self, name: str, value: str) -> str:
+        """
+        Validate the value of the qualifier, the value of the transformation form may be prefixed
+        with the command template ("<px>||200"), only the part after the last "||" is validated.
+
+        Returns:
+            str: The value without the template prefix.
+        """
+        qualifier = self.qualifiers.get(name)
+        if qualifier is None:
+            raise QualifierError(f"Unknown qualifier: {name}")
+        return qualifier.validate(value.split("||")[-1])
+
+
+qualifier_schema = QualifierSchema()
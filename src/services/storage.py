@@ -0,0 +1,217 @@
+import abc
+import asyncio
+import functools
+import io
+import pathlib
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cloudinary.utils
+from fastapi import HTTPException, status
+
+from src.conf import messages
+from src.conf.config import settings
+from src.services.cloud_image import CloudImage
+from src.services.qualifiers import QualifierError
+from src.services.transform_engine import TransformCache
+
+# Blocking calls of the storage SDK run here, so uploads do not stall the event loop
+executor = ThreadPoolExecutor(max_workers=settings.storage_max_workers, thread_name_prefix="storage")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking storage call in the storage thread pool and wait for it at most settings.storage_timeout seconds.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(executor, call), timeout=settings.storage_timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=messages.STORAGE_TIMEOUT)
+
+
+class StorageBackend(abc.ABC):
+    """
+    Interface of the file storages of photos, avatars and QR codes.
+    The methods are blocking, Storage runs them in the storage thread pool.
+    """
+
+    @abc.abstractmethod
+    def upload_image(self, photo_file, folder: str, filename: str = None) -> str:
+        """
+        Store an image file in the folder and return its URL.
+        """
+
+    @abc.abstractmethod
+    def delete_image(self, image_url: str) -> str:
+        """
+        Delete a stored file. Returns "" on success or the error message.
+        """
+
+    @abc.abstractmethod
+    def build_transform_url(self, body, image_url: str) -> str:
+        """
+        The URL of the image with the transformations of the PhotoTransformModel.
+        """
+
+    @abc.abstractmethod
+    def upload_qrcode(self, qr_image: bytes, folder: str, name: str) -> str:
+        """
+        Store a QR code PNG image under the given name and return its URL.
+        """
+
+    @abc.abstractmethod
+    def get_folder(self, image_url: str) -> str | None:
+        """
+        The folder of a stored file, QR codes are stored in its "qr" subfolder.
+        """
+
+    @abc.abstractmethod
+    def render_transform(self, relative: str, transformation: str) -> pathlib.Path | str:
+        """
+        The stored file rendered with the transformation string: the path of the rendered file
+        or the URL of a storage which renders the transformations itself.
+        """
+
+
+class CloudinaryBackend(StorageBackend):
+    def upload_image(self, photo_file, folder: str, filename: str = None) -> str:
+        return CloudImage.upload_image(photo_file, None, folder)
+
+    def delete_image(self, image_url: str) -> str:
+        return CloudImage.delete_image(image_url)
+
+    def build_transform_url(self, body, image_url: str) -> str:
+        return CloudImage.upload_transform_image(body, image_url)
+
+    def upload_qrcode(self, qr_image: bytes, folder: str, name: str) -> str:
+        return CloudImage.upload_qrcode(io.BytesIO(qr_image), folder, name)
+
+    def get_folder(self, image_url: str) -> str | None:
+        return CloudImage.get_folder(image_url)
+
+    def render_transform(self, relative: str, transformation: str) -> str:
+        # Cloudinary renders the transformations of its URLs
+        url, _ = cloudinary.utils.cloudinary_url(relative, raw_transformation=transformation or None, secure=True)
+        return url
+
+
+class LocalBackend(StorageBackend):
+    """
+    Files on the local disk under `root`, served by the /static mount of the app.
+    For load tests and CI without network access.
+
+    Transformations are served from `transform_url` with the Cloudinary qualifiers in the "tr"
+    query parameter (e.g. "/api/media/user/1.jpg?tr=c_fill,h_100,w_200/r_20"), they are rendered
+    by the local transform engine and the variants are kept in `cache_root`.
+    """
+    def __init__(self, root: str, base_url: str, transform_url: str, cache_root: str, max_variants: int):
+        self.root = pathlib.Path(root).resolve()
+        self.base_url = base_url.rstrip("/")
+        self.transform_url = transform_url.rstrip("/")
+        self.cache = TransformCache(cache_root, max_variants)
+
+    def _path(self, relative: str) -> pathlib.Path:
+        path = (self.root / relative).resolve()
+        if not path.is_relative_to(self.root):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.BAD_REQUEST)
+        return path
+
+    def _relative(self, image_url: str) -> str | None:
+        # the path of a stored file or of its transformation, both relative to the storage root
+        url = image_url.split("?", 1)[0]
+        for prefix in (f"{self.base_url}/", f"{self.transform_url}/"):
+            if url.startswith(prefix):
+                return url[len(prefix):]
+        return None
+
+    def _save(self, src, relative: str) -> str:
+        path = self._path(relative)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        return f"{self.base_url}/{relative}"
+
+    def upload_image(self, photo_file, folder: str, filename: str = None) -> str:
+        suffix = pathlib.PurePath(filename).suffix.lower() if filename else ""
+        return self._save(photo_file, f"{folder}/{uuid.uuid4().hex}{suffix or '.jpg'}")
+
+    def delete_image(self, image_url: str) -> str:
+        relative = self._relative(image_url)
+        if relative is None:
+            return messages.NOT_FOUND
+        self._path(relative).unlink(missing_ok=True)
+        self.cache.delete(relative)
+        return ""
+
+    def build_transform_url(self, body, image_url: str) -> str:
+        transformation, _ = cloudinary.utils.generate_transformation_string(
+            transformation=CloudImage.get_transform_params(body))
+        relative = self._relative(image_url)
+        if not transformation or relative is None:
+            return image_url.split("?", 1)[0]
+        return f"{self.transform_url}/{relative}?tr={transformation}"
+
+    def upload_qrcode(self, qr_image: bytes, folder: str, name: str) -> str:
+        return self._save(io.BytesIO(qr_image), f"{folder}/{name}.png")
+
+    def get_folder(self, image_url: str) -> str | None:
+        relative = self._relative(image_url)
+        return relative.rpartition("/")[0] if relative else None
+
+    def render_transform(self, relative: str, transformation: str) -> pathlib.Path:
+        source = self._path(relative)
+        if not source.is_file():
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.NOT_FOUND)
+        if not transformation:
+            return source
+        return self.cache.render(source, relative, transformation)
+
+
+def get_backend() -> StorageBackend:
+    """
+    The storage backend of settings.storage_backend: 'cloudinary' or 'local'.
+    """
+    if settings.storage_backend == "local":
+        return LocalBackend(settings.storage_local_root, settings.storage_local_url,
+                            settings.storage_local_transform_url, settings.transform_cache_dir,
+                            settings.transform_cache_max_variants)
+    if settings.storage_backend != "cloudinary":
+        raise ValueError(f"Unknown storage backend: {settings.storage_backend}")
+    return CloudinaryBackend()
+
+
+class Storage:
+    """
+    Async facade of the storage backend for the routes and repositories.
+    """
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+
+    async def upload_image(self, photo_file, user, folder: str = None, filename: str = None) -> str:
+        return await run_blocking(self.backend.upload_image, photo_file, folder or user.username, filename)
+
+    async def delete_image(self, image_url: str) -> str:
+        return await run_blocking(self.backend.delete_image, image_url)
+
+    async def upload_qrcode(self, qr_image: bytes, qr_folder: str, qr_name: str) -> str:
+        return await run_blocking(self.backend.upload_qrcode, qr_image, qr_folder, qr_name)
+
+    def upload_transform_image(self, body, photo_file_url) -> str:
+        # Only builds the URL of the transformation, no I/O
+        try:
+            return self.backend.build_transform_url(body, photo_file_url)
+        except QualifierError as err:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"{messages.INVALID_TRANSFORMATION}: {err}")
+
+    def get_folder(self, image_url: str) -> str | None:
+        return self.backend.get_folder(image_url)
+
+    async def render_transform(self, relative: str, transformation: str) -> pathlib.Path | str:
+        return await run_blocking(self.backend.render_transform, relative, transformation)
+
+
+storage = Storage(get_backend())
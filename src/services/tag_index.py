@@ -0,0 +1,79 @@
+import asyncio
+import bisect
+import heapq
+import time
+from typing import Dict, Iterable, List
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from src.conf.config import settings
+from src.database.db import db_execute
+from src.database.models import Tag
+
+
+class TagIndex:
+    """
+    Tag names of this process in sorted order for the prefix autocomplete.
+
+    The tags of a prefix are a contiguous range of the sorted names, found with two binary searches,
+    and the most popular of them are picked by photo_count. New tags and count changes of this process
+    are applied to the index when their transaction is committed; the whole index is reloaded every `ttl`
+    seconds to pick up the changes of other workers.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        # names are unique case-sensitively, so "Sun" and "sun" are two tags with the same lowercase name
+        self._keys: List[tuple] = []            # (lowercase name, id), sorted
+        self._tags: Dict[int, list] = {}        # id: [id, name, photo_count]
+        self._loaded = None
+        self._lock = asyncio.Lock()
+
+    def is_stale(self) -> bool:
+        return self._loaded is None or time.monotonic() - self._loaded > self.ttl
+
+    async def refresh(self, session: Session) -> None:
+        async with self._lock:
+            if not self.is_stale():
+                return
+            rows = (await db_execute(session, select(Tag.id, Tag.name, Tag.photo_count))).all()
+            self._tags = {row.id: [row.id, row.name, row.photo_count] for row in rows}
+            self._keys = sorted((row.name.lower(), row.id) for row in rows)
+            self._loaded = time.monotonic()
+
+    async def search(self, prefix: str, limit: int, session: Session) -> List[list]:
+        """
+        The most popular tags starting with the prefix (case-insensitive), none for a blank prefix.
+
+        Returns:
+            List[list]: [id, name, photo_count] of the tags ordered by photo_count and name.
+        """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        if self.is_stale():
+            await self.refresh(session)
+        start = bisect.bisect_left(self._keys, (prefix,))
+        end = bisect.bisect_left(self._keys, (prefix + "\U0010ffff",), lo=start)
+        tags = (self._tags[tag_id] for _, tag_id in self._keys[start:end])
+        return heapq.nsmallest(limit, tags, key=lambda tag: (-tag[2], tag[1]))
+
+    def add(self, tags: Iterable[tuple]) -> None:
+        """
+        Add new tags, (id, name, photo_count), to a loaded index.
+        """
+        if self._loaded is None:
+            return
+        for tag_id, name, photo_count in tags:
+            if tag_id not in self._tags:
+                bisect.insort(self._keys, (name.lower(), tag_id))
+            self._tags[tag_id] = [tag_id, name, photo_count or 0]
+
+    def update_counts(self, tag_ids: Iterable[int], delta: int) -> None:
+        for tag_id in tag_ids:
+            tag = self._tags.get(tag_id)
+            if tag is not None:
+                tag[2] += delta
+
+
+tag_index = TagIndex(ttl=settings.tag_index_ttl)
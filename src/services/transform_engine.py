@@ -0,0 +1,351 @@
+import hashlib
+import io
+import os
+import pathlib
+import shutil
+import tempfile
+
+from PIL import Image, ImageChops, ImageDraw, ImageEnhance, ImageFilter, ImageOps
+
+from src.services.qualifiers import QualifierError, qualifier_schema
+
+PREFIXES = qualifier_schema.prefixes
+EFFECTS = qualifier_schema["effect"].commands
+# the largest size in pixels of the rendered image, a relative size ("w_4.0") can not exceed it either
+SIZE_LIMITS = {name: next(command.params[0].maximum for command in qualifier_schema[name].templates
+                          if command.name == "<px>")
+               for name in ("height", "width")}
+
+COMPASS = {
+    "north_west": (0.0, 0.0), "north": (0.5, 0.0), "north_east": (1.0, 0.0),
+    "west": (0.0, 0.5), "center": (0.5, 0.5), "east": (1.0, 0.5),
+    "south_west": (0.0, 1.0), "south": (0.5, 1.0), "south_east": (1.0, 1.0),
+}
+
+# formats Pillow can write, some of the registered ones (e.g. PSD) can only be read
+FORMATS = {ext.lstrip("."): fmt for ext, fmt in Image.registered_extensions().items() if fmt in Image.SAVE}
+DEFAULT_FORMAT = "PNG"
+AUTO_FORMAT = "webp"
+AUTO_QUALITY = 80
+
+
+class TransformError(QualifierError):
+    """
+    The transformation string can not be rendered.
+    """
+
+
+def parse_transformation(transformation: str) -> list:
+    """
+    Parse a Cloudinary transformation string ("c_fill,h_100,w_200/r_20/e_sepia") into
+    a list of components, each a dict of qualifier name -> value, e.g. [{"crop": "fill", ...}, {"radius": "20"}].
+    The values are validated by the compiled qualifiers of src/transformation.json.
+    """
+    components = []
+    for part in filter(None, transformation.split("/")):
+        component = {}
+        for param in filter(None, part.split(",")):
+            prefix, _, value = param.partition("_")
+            name = PREFIXES.get(prefix)
+            if name is None or not value:
+                raise TransformError(f"Unknown qualifier: {param}")
+            component[name] = qualifier_schema.validate(name, value)
+        components.append(component)
+    return components
+
+
+def get_output_format(components: list, source_format: str) -> str:
+    """
+    The Pillow format of the rendered image: the last fetch_format or the format of the source
+    (PNG if Pillow can not write the format of the source).
+    """
+    fmt = source_format if source_format in Image.SAVE else DEFAULT_FORMAT
+    for component in components:
+        value = component.get("fetch_format")
+        if value:
+            value = AUTO_FORMAT if value == "auto" else value.lower()
+            fmt = FORMATS.get(value)
+            if fmt is None:
+                raise TransformError(f"Unsupported format: {value}")
+    return fmt
+
+
+def _check_size(name: str, size: int) -> int:
+    if size > SIZE_LIMITS[name]:
+        raise TransformError(f"Invalid {name}: {size} is larger than {SIZE_LIMITS[name]} pixels")
+    return size
+
+
+def _size(value: str | None, name: str, original: int) -> int | None:
+    if value is None:
+        return None
+    if value in ("ih", "iw"):
+        return original
+    size = max(1, round(original * float(value))) if "." in value else int(value)
+    return _check_size(name, size)
+
+
+def _centering(gravity: str | None) -> tuple:
+    # face detection is not available locally, such gravities fall back to the center
+    return COMPASS.get(gravity, COMPASS["center"])
+
+
+def _background(img: Image.Image) -> tuple:
+    return (255, 255, 255, 0) if img.mode == "RGBA" else (255, 255, 255)
+
+
+def _resize(img: Image.Image, component: dict) -> Image.Image:
+    crop = component.get("crop", "scale")
+    centering = _centering(component.get("gravity"))
+    width = _size(component.get("width"), "width", img.width)
+    height = _size(component.get("height"), "height", img.height)
+    if width is None and height is None:
+        return img
+    # a missing dimension keeps the aspect ratio
+    if width is None:
+        width = _check_size("width", max(1, round(img.width * height / img.height)))
+    if height is None:
+        height = _check_size("height", max(1, round(img.height * width / img.width)))
+
+    ratio = min(width / img.width, height / img.height)
+    if crop == "scale":
+        return img.resize((width, height), Image.LANCZOS)
+    if crop in ("fit", "limit", "mfit"):
+        if (crop == "limit" and ratio >= 1) or (crop == "mfit" and ratio <= 1):
+            return img
+        return ImageOps.contain(img, (width, height), Image.LANCZOS)
+    if crop in ("fill", "lfill", "fill_pad", "thumb"):
+        if crop == "lfill" and (img.width < width or img.height < height):
+            width, height = min(width, img.width), min(height, img.height)
+        return ImageOps.fit(img, (width, height), Image.LANCZOS, centering=centering)
+    if crop == "crop":
+        width, height = min(width, img.width), min(height, img.height)
+        left = round((img.width - width) * centering[0])
+        top = round((img.height - height) * centering[1])
+        return img.crop((left, top, left + width, top + height))
+    # pad, lpad, mpad
+    if not ((crop == "lpad" and ratio >= 1) or (crop == "mpad" and ratio <= 1)):
+        img = ImageOps.contain(img, (width, height), Image.LANCZOS)
+    padded = Image.new(img.mode, (max(width, img.width), max(height, img.height)), _background(img))
+    left = round((padded.width - img.width) * centering[0])
+    top = round((padded.height - img.height) * centering[1])
+    padded.paste(img, (left, top))
+    return padded
+
+
+def _round_corners(img: Image.Image, value: str) -> Image.Image:
+    img = img.convert("RGBA")
+    mask = Image.new("L", img.size, 255)
+    draw = ImageDraw.Draw(mask)
+    if value == "max":
+        mask = Image.new("L", img.size, 0)
+        ImageDraw.Draw(mask).ellipse((0, 0, img.width - 1, img.height - 1), fill=255)
+    else:
+        radii = [int(radius) for radius in value.split(":")]
+        # the same order as the CSS border-radius: top-left, top-right, bottom-right, bottom-left
+        radii = {1: radii * 4, 2: radii * 2, 3: radii + radii[1:2]}.get(len(radii), radii)
+        w, h = img.size
+        for (x, y), radius in zip(((0, 0), (1, 0), (1, 1), (0, 1)), radii):
+            radius = min(radius, w // 2, h // 2)
+            if radius <= 0:
+                continue
+            left, top = x * (w - radius), y * (h - radius)
+            draw.rectangle((left, top, left + radius - 1, top + radius - 1), fill=0)
+            cx, cy = (w - 2 * radius) * x, (h - 2 * radius) * y
+            draw.ellipse((cx, cy, cx + 2 * radius - 1, cy + 2 * radius - 1), fill=255)
+    img.putalpha(ImageChops.darker(img.getchannel("A"), mask))
+    return img
+
+
+def _with_alpha(func):
+    # run an RGB filter and keep the transparency of the image
+    def apply(img: Image.Image, level: int) -> Image.Image:
+        if img.mode != "RGBA":
+            return func(img.convert("RGB"), level)
+        alpha = img.getchannel("A")
+        img = func(img.convert("RGB"), level).convert("RGBA")
+        img.putalpha(alpha)
+        return img
+    return apply
+
+
+def _channel(index: int):
+    def apply(img, level):
+        bands = list(img.split())
+        bands[index] = bands[index].point(lambda p: min(255, round(p * (1 + level / 100))))
+        return Image.merge("RGB", bands)
+    return apply
+
+
+def _sepia(img, level):
+    sepia = ImageOps.colorize(ImageOps.grayscale(img), "#000000", "#ffe0b0", mid="#a07850")
+    return Image.blend(img, sepia, level / 100)
+
+
+def _blackwhite(img, level):
+    threshold = 255 * level / 100
+    return ImageOps.grayscale(img).point(lambda p: 255 if p > threshold else 0).convert("RGB")
+
+
+def _gamma(img, level):
+    gamma = max(0.01, 1 + level / 100)
+    return img.point(lambda p: round(255 * (p / 255) ** (1 / gamma)))
+
+
+def _hue(img, level):
+    shift = round(level * 128 / 100)
+    h, s, v = img.convert("HSV").split()
+    return Image.merge("HSV", (h.point(lambda p: (p + shift) % 256), s, v)).convert("RGB")
+
+
+def _autocontrast(img, level):
+    return Image.blend(img, ImageOps.autocontrast(img, cutoff=1), (level or 100) / 100)
+
+
+def _vignette(img, level):
+    gradient = Image.radial_gradient("L").resize(img.size, Image.BILINEAR)
+    mask = gradient.point(lambda p: round(p * level / 100))
+    return Image.composite(Image.new("RGB", img.size), img, mask)
+
+
+EFFECT_FUNCTIONS = {
+    "grayscale": lambda img, level: ImageOps.grayscale(img).convert("RGB"),
+    "blackwhite": _blackwhite,
+    "negate": lambda img, level: ImageOps.invert(img),
+    "sepia": _sepia,
+    "blur": lambda img, level: img.filter(ImageFilter.GaussianBlur(level / 50)),
+    "sharpen": lambda img, level: img.filter(ImageFilter.UnsharpMask(radius=2, percent=level, threshold=2)),
+    "brightness": lambda img, level: ImageEnhance.Brightness(img).enhance(1 + level / 100),
+    "brightness_hsb": lambda img, level: ImageEnhance.Brightness(img).enhance(1 + level / 100),
+    "contrast": lambda img, level: ImageEnhance.Contrast(img).enhance(1 + level / 100),
+    "saturation": lambda img, level: ImageEnhance.Color(img).enhance(1 + level / 100),
+    "gamma": _gamma,
+    "hue": _hue,
+    "red": _channel(0),
+    "green": _channel(1),
+    "blue": _channel(2),
+    "auto_brightness": _autocontrast,
+    "auto_color": _autocontrast,
+    "auto_contrast": _autocontrast,
+    "improve": _autocontrast,
+    "fill_light": _autocontrast,
+    "vignette": _vignette,
+}
+
+
+def _effect(img: Image.Image, value: str) -> Image.Image:
+    name, _, level = value.partition(":")
+    func = EFFECT_FUNCTIONS.get(name)
+    if func is None:
+        # effects based on face or object detection (bgremoval, redeye, pixelate_faces, ...) are not rendered locally
+        return img
+    try:
+        level = int(level.split(":")[0]) if level else (EFFECTS[name].default or 0)
+    except ValueError:
+        raise TransformError(f"Invalid effect level: {value}")
+    return _with_alpha(func)(img, level)
+
+
+def render_transformation(source, transformation: str) -> tuple:
+    """
+    Render the image file with the Cloudinary transformation string.
+    A plain function without I/O besides reading the source, so it can run in a thread or a process pool.
+
+    Args:
+        source: The path or the file object of the source image.
+        transformation (str): The transformation, e.g. "c_fill,g_north,h_100,w_200/r_max/e_sepia:50/q_auto/f_webp".
+
+    Returns:
+        tuple: The bytes of the rendered image and its Pillow format.
+    """
+    components = parse_transformation(transformation)
+    with Image.open(source) as img:
+        source_format = img.format or DEFAULT_FORMAT
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+
+    quality = None
+    for component in components:
+        img = _resize(img, component)
+        if "radius" in component:
+            img = _round_corners(img, component["radius"])
+        if "effect" in component:
+            img = _effect(img, component["effect"])
+        if "quality" in component:
+            value = component["quality"].split(":")[0]
+            quality = AUTO_QUALITY if value == "auto" else int(value)
+
+    fmt = get_output_format(components, source_format)
+    if img.mode == "RGBA" and fmt in ("JPEG", "BMP"):
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+
+    buffer = io.BytesIO()
+    options = {"quality": quality} if quality and fmt in ("JPEG", "WEBP", "AVIF") else {}
+    try:
+        img.save(buffer, format=fmt, **options)
+    except (OSError, KeyError, ValueError) as err:
+        raise TransformError(f"Can not save the image as {fmt}: {err}")
+    return buffer.getvalue(), fmt
+
+
+class TransformCache:
+    """
+    Rendered variants on the local disk.
+
+    A variant is stored as <root>/<relative path of the source>/<key>.<ext>, the key is the hash of
+    the transformation and of the modification time and size of the source, so a replaced source
+    gets new variants and all variants of a source are deleted with it.
+    At most `max_variants` variants of a source are kept, the least recently rendered ones are deleted.
+    """
+    def __init__(self, root: str, max_variants: int):
+        self.root = pathlib.Path(root).resolve()
+        self.max_variants = max_variants
+
+    def _variants(self, relative: str) -> pathlib.Path:
+        return self.root / relative
+
+    def get_path(self, source: pathlib.Path, relative: str, transformation: str) -> pathlib.Path:
+        stat = source.stat()
+        key = hashlib.sha256(f"{transformation}\n{stat.st_mtime_ns}\n{stat.st_size}".encode()).hexdigest()
+        fmt = get_output_format(parse_transformation(transformation), Image.registered_extensions().get(
+            source.suffix.lower(), DEFAULT_FORMAT))
+        ext = "jpg" if fmt == "JPEG" else fmt.lower()
+        return self._variants(relative) / f"{key}.{ext}"
+
+    def render(self, source: pathlib.Path, relative: str, transformation: str) -> pathlib.Path:
+        """
+        The path of the rendered variant, the variant is rendered on the first request only.
+        """
+        path = self.get_path(source, relative, transformation)
+        if path.exists():
+            return path
+
+        data, _ = render_transformation(source, transformation)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._evict(path.parent)
+        # concurrent renders of the same variant write the same bytes, the last rename wins
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        return path
+
+    def _evict(self, variants: pathlib.Path) -> None:
+        # make room for one more variant
+        files = []
+        for entry in os.scandir(variants):
+            try:
+                files.append((entry.stat().st_mtime_ns, entry.path))
+            except FileNotFoundError:
+                pass
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_variants + 1)]:
+            pathlib.Path(path).unlink(missing_ok=True)
+
+    def delete(self, relative: str) -> None:
+        """
+        Delete all variants of the source.
+        """
+        shutil.rmtree(self._variants(relative), ignore_errors=True)
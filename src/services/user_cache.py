@@ -0,0 +1,43 @@
+import typing as t
+
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from src.conf.config import settings
+from src.database.db import db_merge
+from src.database.models import User
+from src.services.cache import TTLCache
+
+# Column values of authenticated users keyed by email: {email: (iat of the token, {column: value})}.
+# The cache and forget_user are per process, on other workers a changed user stays cached for at most
+# settings.auth_cache_ttl seconds; Auth.get_current_user uses the cache only for read-only requests.
+user_cache = TTLCache(maxsize=settings.auth_cache_size, ttl=settings.auth_cache_ttl)
+
+
+def remember_user(user: User, iat: t.Any) -> None:
+    """
+    Store the column values of the user, loaded for an access token issued at `iat`.
+    """
+    if settings.auth_cache_ttl <= 0:
+        return
+    values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+    user_cache.set(user.email, (iat, values))
+
+
+async def recall_user(email: str, iat: t.Any, db: Session) -> User | None:
+    """
+    Rebuild the cached user of the token and attach it to the session without a query.
+    Returns None if the user is not cached or was cached for another token.
+    """
+    item = user_cache.get(email)
+    if item is None or item[0] != iat:
+        return None
+    user = User(**item[1])
+    make_transient_to_detached(user)
+    return await db_merge(db, user, load=False)
+
+
+def forget_user(email: str) -> None:
+    """
+    Drop the cached user, called when the user's row changes (ban, roles, tokens, avatar...).
+    """
+    user_cache.pop(email)
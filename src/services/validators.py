@@ -1,10 +1,38 @@
 from typing import List
 
 from fastapi import HTTPException, status
-import requests
+import httpx
 
 from src.conf import messages
-from src.conf.config import MAX_TAGS_COUNT
+from src.conf.config import MAX_TAGS_COUNT, settings
+from src.services.cache import TTLCache
+
+# Results of check_transform_url by URL: "" for a valid transformation or the error of Cloudinary
+transform_url_cache = TTLCache(maxsize=settings.transform_check_cache_size, ttl=settings.transform_check_ttl)
+http_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    The shared HTTP client, it keeps the connections to the image storage open between requests.
+    """
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(timeout=settings.transform_check_timeout,
+                                        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                                        follow_redirects=True)
+    return http_client
+
+
+async def close_http_client() -> None:
+    """
+    Close the connections of the shared HTTP client, called at the shutdown of the app.
+    """
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
 
 class Validator:
 
@@ -37,15 +65,27 @@ class Validator:
 
 
     async def check_transform_url(self, url) -> str:
+        """
+        Check that the storage can render the transformation of the URL (HEAD request).
+        Results are cached by URL, errors (any response other than 2xx) for a shorter time.
+        Returns "" if the URL is valid, otherwise the error.
+        """
         result = ""
+        if not url.startswith("http"):
+            # files of the local storage backend are served by the app itself
+            return result
+        cached = transform_url_cache.get(url)
+        if cached is not None:
+            return cached
         try:
-            req = requests.head(url, allow_redirects=True)
-            if req.status_code != 200:
-                result = req.headers.get('x-cld-error')
+            req = await get_http_client().head(url)
+            if not req.is_success:
+                result = req.headers.get('x-cld-error') or f"{messages.INVALID_TRANSFORMATION}: HTTP {req.status_code}"
+                transform_url_cache.set(url, result, ttl=settings.transform_check_error_ttl)
+            else:
+                transform_url_cache.set(url, result)
         except HTTPException as err:
             result = err.detail
         except Exception as err:
             result = err.args
         return result
-
-